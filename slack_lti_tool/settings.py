@@ -23,7 +23,9 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 SECRET_KEY = 'change this to a proper random key before deploying to production'
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+# With DEBUG off, Django wraps the template loaders in its cached loader, so each template is compiled once per
+# worker.
+DEBUG = os.environ.get('DJANGO_DEBUG', 'True') == 'True'
 
 ALLOWED_HOSTS = []
 
@@ -45,6 +47,8 @@ INSTALLED_APPS = [
 INSTALLED_APPS.append('sslserver')
 
 MIDDLEWARE = [
+    'django.middleware.gzip.GZipMiddleware',
+    'slack_provisioning.middleware.DatabaseRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -52,10 +56,15 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django_auth_lti.middleware_patched.MultiLTILaunchAuthMiddleware',
+    'slack_provisioning.middleware.SlackTenantMiddleware',
+    'slack_provisioning.middleware.AuditContextMiddleware',
+    'slack_provisioning.middleware.ProfilingMiddleware',
 ]
 
 AUTHENTICATION_BACKENDS = [
     'django_auth_lti.backends.LTIAuthBackend',
+    # for support staff signing in to the Django admin
+    'django.contrib.auth.backends.ModelBackend',
 ]
 
 ROOT_URLCONF = 'slack_lti_tool.urls'
@@ -71,6 +80,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'slack_provisioning.context_processors.slack_provisioning',
             ],
         },
     },
@@ -82,10 +92,41 @@ WSGI_APPLICATION = 'slack_lti_tool.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 
+# keep database connections open between requests instead of reconnecting on every launch
+CONN_MAX_AGE = int(os.environ.get('DJANGO_CONN_MAX_AGE', 60))
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'CONN_MAX_AGE': CONN_MAX_AGE,
+    }
+}
+
+# Optional read replica: workspace and member lookups are read from it, see slack_provisioning/db_router.py.
+# To try it locally with two sqlite databases, set DJANGO_REPLICA_DB_NAME and run
+# `./manage.py migrate --database replica`.
+if os.environ.get('DJANGO_REPLICA_DB_NAME'):
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ['DJANGO_REPLICA_DB_NAME'],
+        'CONN_MAX_AGE': CONN_MAX_AGE,
+        'TEST': {
+            'MIRROR': 'default',
+        },
+    }
+
+DATABASE_ROUTERS = ['slack_provisioning.db_router.ReplicaRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/2.2/topics/cache/
+# Slack rate limit usage is counted in this cache, so that batch commands leave budget for the web workers. That
+# only works across processes with a shared backend such as memcached or redis.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 }
 
@@ -130,7 +171,50 @@ STATIC_URL = '/static/'
 
 # TBD : document API scopes needed
 SLACK_PROVISIONING = {
-    'slack_api_token': os.environ.get('SLACK_API_TOKEN', 'missing_token_configuration')
+    'slack_api_token': os.environ.get('SLACK_API_TOKEN', 'missing_token_configuration'),
+    # seconds to cache the rendered launch page fragments that only depend on the workspace
+    'workspace_fragment_cache_timeout': 300,
+    # completed workspace rows are cached in each process for workspace_cache_timeout seconds
+    'workspace_cache_size': 1024,
+    'workspace_cache_timeout': 60,
+    # seconds to wait for a connection to Slack, and for each read from it, before the call fails
+    'slack_connect_timeout': 3.05,
+    'slack_read_timeout': 10,
+    # seconds each workspace's admin ids are cached, shared by staff launches
+    'admin_cache_timeout': 300,
+    # audit events are written in batches of audit_flush_size, or every audit_flush_interval seconds
+    'audit_flush_size': 100,
+    'audit_flush_interval': 5,
+    # fraction of requests to profile; requests with a signed X-Slack-Tool-Profile header are always profiled
+    # (see `./manage.py summarize_profiles --make-token`)
+    'profile_sample_rate': float(os.environ.get('SLACK_PROFILE_SAMPLE_RATE', 0)),
+    'profile_dir': os.path.join(BASE_DIR, 'profiles'),
+    'profile_max_files': 200,
+    # requests to the launch, provision and join views allowed to wait on Slack at once, per process; up to
+    # admission_max_queue more wait admission_queue_timeout seconds for a slot, the rest get a 503
+    'admission_max_concurrent': 4,
+    'admission_max_queue': 8,
+    'admission_queue_timeout': 2,
+    # cap on those requests across all processes, counted in the shared cache (needs a shared CACHES backend)
+    # 'admission_cluster_max': 32,
+    # longest a /slack_provisioning/status/<course_sis_id>/ request waits for a change (?wait=<seconds>), and how
+    # many may wait at once per process; each holds a worker thread, so others are answered right away
+    'status_poll_timeout': 10,
+    'status_poll_max_concurrent': 2,
+    # seconds a course roster read from the LTI membership service is cached; it's revalidated before each use
+    'roster_cache_timeout': 24 * 60 * 60,
+    # bearer token for /slack_provisioning/metrics/
+    'metrics_token': os.environ.get('SLACK_METRICS_TOKEN'),
+    # To serve more than one Enterprise Grid, add a tenant per grid. Launches are routed to a tenant by their LTI
+    # consumer key or Canvas account id; anything else uses slack_api_token above. Each tenant gets its own
+    # connection pool (pool_size) and rate limit budget (rate_limit_tiers, rate_limit_share).
+    # 'tenants': {
+    #     'law': {
+    #         'slack_api_token': os.environ.get('SLACK_API_TOKEN_LAW'),
+    #         'consumer_keys': ['law'],
+    #         'account_ids': ['12'],
+    #     },
+    # },
 }
 
 # define your LTI key/secret pairs here:
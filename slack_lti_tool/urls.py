@@ -18,5 +18,6 @@ from django.urls import path, include
 
 
 urlpatterns = [
+    path('admin/', admin.site.urls),
     path('slack_provisioning/', include(('slack_provisioning.urls', 'slack_provisioning'), namespace="sp")),
 ]
@@ -0,0 +1 @@
+default_app_config = 'slack_provisioning.apps.SlackProvisioningConfig'
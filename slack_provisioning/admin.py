@@ -1,3 +1,50 @@
 from django.contrib import admin
+from django.db.models import Count
 
-# Register your models here.
+from .models import SlackAuditEvent, SlackWorkspace, SlackWorkspaceMember
+
+
+@admin.register(SlackWorkspace)
+class SlackWorkspaceAdmin(admin.ModelAdmin):
+    list_display = ('course_sis_id', 'team_name', 'team_domain', 'team_id', 'term_name', 'status',
+                    'member_count', 'created_at')
+    list_filter = ('status', 'term_name', 'tenant', 'created_at')
+    search_fields = ('=course_sis_id', '=team_id', '=team_domain')
+    list_per_page = 100
+    # skip the unfiltered COUNT(*) over the whole table on every changelist page
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        # member counts come from the same query as the changelist rows
+        return super().get_queryset(request).annotate(member_count=Count('members'))
+
+    def member_count(self, obj):
+        return obj.member_count
+    member_count.admin_order_field = 'member_count'
+
+
+@admin.register(SlackWorkspaceMember)
+class SlackWorkspaceMemberAdmin(admin.ModelAdmin):
+    list_display = ('univ_id', 'slack_user_id', 'membership_type', 'slack_workspace', 'created_at')
+    list_filter = ('membership_type',)
+    list_select_related = ('slack_workspace',)
+    search_fields = ('=univ_id', '=slack_user_id', '=slack_workspace__course_sis_id')
+    # a select box would load every workspace into the change form
+    raw_id_fields = ('slack_workspace',)
+    list_per_page = 100
+    show_full_result_count = False
+
+
+@admin.register(SlackAuditEvent)
+class SlackAuditEventAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'action', 'course_sis_id', 'univ_id', 'slack_user_id', 'team_id', 'tenant')
+    list_filter = ('action', 'tenant', 'created_at')
+    search_fields = ('=course_sis_id', '=univ_id', '=slack_user_id', '=team_id')
+    list_per_page = 100
+    show_full_result_count = False
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
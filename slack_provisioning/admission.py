@@ -0,0 +1,203 @@
+"""
+Admission control for views that call Slack.
+
+When Slack slows down, every worker thread can end up blocked in a Slack call and the tool stops responding,
+even for pages that don't need Slack. Views wrapped in `admission_controlled` are limited to
+admission_max_concurrent requests in flight per process. Up to admission_max_queue more wait at most
+admission_queue_timeout seconds for a slot, and anything beyond that gets a fast 503 with a Retry-After header.
+
+Optionally, admission_cluster_max caps the requests in flight across all processes, counted in the shared
+Django cache. The count is kept per admission_cluster_slot_seconds window, like the rate limit usage counts, so
+a process that dies mid-request only inflates it until its window ages out.
+"""
+import functools
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.shortcuts import render
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONCURRENT = 4
+DEFAULT_MAX_QUEUE = 8
+# seconds a request waits for a slot before it's turned away
+DEFAULT_QUEUE_TIMEOUT = 2
+# seconds clients are asked to wait before retrying
+DEFAULT_RETRY_AFTER = 5
+DEFAULT_CLUSTER_SLOT_SECONDS = 60
+
+CLUSTER_KEY_PREFIX = 'slack:admission'
+
+
+class AdmissionController:
+    def __init__(self, max_concurrent, max_queue, queue_timeout, cluster_max=None,
+                 cluster_slot_seconds=DEFAULT_CLUSTER_SLOT_SECONDS):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.cluster_max = cluster_max
+        self.cluster_slot_seconds = cluster_slot_seconds
+        self.in_flight = 0
+        self.queued = 0
+        self.max_queued = 0
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+        self.rejected_cluster = 0
+        self._condition = threading.Condition()
+
+    def _acquire_local(self):
+        """
+        :return: None if a slot was taken, otherwise the reason the request was turned away.
+        """
+        with self._condition:
+            if self.in_flight < self.max_concurrent:
+                self.in_flight += 1
+                return None
+            if self.queued >= self.max_queue:
+                self.rejected_queue_full += 1
+                return 'queue_full'
+
+            self.queued += 1
+            self.max_queued = max(self.max_queued, self.queued)
+            try:
+                admitted = self._condition.wait_for(lambda: self.in_flight < self.max_concurrent,
+                                                    timeout=self.queue_timeout)
+            finally:
+                self.queued -= 1
+            if not admitted:
+                self.rejected_timeout += 1
+                return 'timeout'
+            self.in_flight += 1
+            return None
+
+    def _release_local(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+    def _cluster_keys(self, now):
+        slot = int(now // self.cluster_slot_seconds)
+        return [f'{CLUSTER_KEY_PREFIX}:{slot}', f'{CLUSTER_KEY_PREFIX}:{slot - 1}']
+
+    def _acquire_cluster(self):
+        """
+        :return: The cache key the request was counted under, or None if the cluster is at its cap.
+        """
+        keys = self._cluster_keys(time.time())
+        key = keys[0]
+        cache.add(key, 0, timeout=self.cluster_slot_seconds * 3)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, timeout=self.cluster_slot_seconds * 3)
+        if sum(cache.get_many(keys).values()) > self.cluster_max:
+            self._release_cluster(key)
+            return None
+        return key
+
+    def _release_cluster(self, key):
+        try:
+            cache.decr(key)
+        except ValueError:
+            # the window has already expired
+            pass
+
+    def acquire(self):
+        """
+        :return: A ticket to pass to release(), or None if the request should be turned away.
+        """
+        reason = self._acquire_local()
+        if reason is not None:
+            logger.warning(f'Turning away a Slack-bound request: {reason} ({self.in_flight} in flight, '
+                           f'{self.queued} queued)')
+            return None
+        cluster_key = None
+        if self.cluster_max:
+            cluster_key = self._acquire_cluster()
+            if cluster_key is None:
+                self._release_local()
+                with self._condition:
+                    self.rejected_cluster += 1
+                logger.warning('Turning away a Slack-bound request: the cluster is at admission_cluster_max')
+                return None
+        with self._condition:
+            self.admitted += 1
+        return (cluster_key,)
+
+    def release(self, ticket):
+        cluster_key, = ticket
+        if cluster_key is not None:
+            self._release_cluster(cluster_key)
+        self._release_local()
+
+    def stats(self):
+        """
+        :return: In-flight and queued requests and admission counters for this process.
+        """
+        with self._condition:
+            stats = {
+                'in_flight': self.in_flight,
+                'queued': self.queued,
+                'max_queued': self.max_queued,
+                'max_concurrent': self.max_concurrent,
+                'max_queue': self.max_queue,
+                'admitted': self.admitted,
+                'rejected_queue_full': self.rejected_queue_full,
+                'rejected_timeout': self.rejected_timeout,
+                'rejected_cluster': self.rejected_cluster,
+            }
+        if self.cluster_max:
+            stats['cluster_in_flight'] = sum(cache.get_many(self._cluster_keys(time.time())).values())
+            stats['cluster_max'] = self.cluster_max
+        return stats
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_admission_controller():
+    global _controller
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                config = settings.SLACK_PROVISIONING
+                _controller = AdmissionController(
+                    max_concurrent=config.get('admission_max_concurrent', DEFAULT_MAX_CONCURRENT),
+                    max_queue=config.get('admission_max_queue', DEFAULT_MAX_QUEUE),
+                    queue_timeout=config.get('admission_queue_timeout', DEFAULT_QUEUE_TIMEOUT),
+                    cluster_max=config.get('admission_cluster_max'),
+                    cluster_slot_seconds=config.get('admission_cluster_slot_seconds', DEFAULT_CLUSTER_SLOT_SECONDS),
+                )
+    return _controller
+
+
+def busy_response(request):
+    """
+    The 503 "try again" page, also used when a Slack call runs out of rate limit budget or times out.
+    """
+    retry_after = settings.SLACK_PROVISIONING.get('admission_retry_after', DEFAULT_RETRY_AFTER)
+    response = render(request, 'slack_provisioning/busy.html', {'retry_after': retry_after}, status=503)
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+def admission_controlled(view_func):
+    """
+    Limits the number of requests to the wrapped view in flight at once; see the module docstring.
+    """
+    @functools.wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        controller = get_admission_controller()
+        ticket = controller.acquire()
+        if ticket is None:
+            return busy_response(request)
+        try:
+            return view_func(request, *args, **kwargs)
+        finally:
+            controller.release(ticket)
+    return wrapper
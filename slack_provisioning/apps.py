@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class SlackProvisioningConfig(AppConfig):
     name = 'slack_provisioning'
+
+    def ready(self):
+        # connects the signal receivers that keep cached workspace rows current
+        from . import workspace_cache  # noqa: F401
@@ -0,0 +1,136 @@
+"""
+Durable record of who was given access to what in Slack.
+
+Events are added to a bounded in-memory buffer and written in batches with bulk_create by a background thread,
+once the buffer reaches a size threshold or a time interval passes, so recording an event doesn't add a database
+write to the request. Course and user ids are taken from the current audit context, which
+AuditContextMiddleware sets from the LTI launch.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .models import SlackAuditEvent
+from .tenants import get_current_tenant
+
+logger = logging.getLogger(__name__)
+
+# number of buffered events that triggers a write
+DEFAULT_FLUSH_SIZE = 100
+# seconds between writes when fewer events are buffered
+DEFAULT_FLUSH_INTERVAL = 5
+# events held in memory at most; the oldest are dropped if the database can't keep up
+DEFAULT_MAX_BUFFERED = 10000
+
+_audit_context = contextvars.ContextVar('audit_context', default={})
+
+
+@contextmanager
+def audit_context(**fields):
+    """
+    Fills in the given fields (eg: course_sis_id, univ_id) of events recorded inside the block.
+    """
+    token = _audit_context.set(dict(_audit_context.get(), **fields))
+    try:
+        yield
+    finally:
+        _audit_context.reset(token)
+
+
+class AuditBuffer:
+    def __init__(self, flush_size, flush_interval, max_buffered):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_buffered = max_buffered
+        self.dropped = 0
+        self._events = []
+        self._lock = threading.Lock()
+        self._flush_requested = threading.Event()
+        self._thread = None
+
+    def add(self, event):
+        with self._lock:
+            if len(self._events) >= self.max_buffered:
+                self._events.pop(0)
+                self.dropped += 1
+                logger.error(f'Audit buffer full; dropped the oldest event ({self.dropped} dropped so far)')
+            self._events.append(event)
+            buffered = len(self._events)
+            if self._thread is None:
+                # started lazily so each forked worker gets its own flusher
+                self._thread = threading.Thread(target=self._run, name='slack-audit-flusher', daemon=True)
+                self._thread.start()
+        if buffered >= self.flush_size:
+            self._flush_requested.set()
+
+    def flush(self):
+        """
+        Writes all buffered events to the database.
+        :return: The number of events written.
+        """
+        with self._lock:
+            events, self._events = self._events, []
+        if not events:
+            return 0
+
+        close_old_connections()
+        try:
+            SlackAuditEvent.objects.bulk_create(events, batch_size=self.flush_size)
+        except Exception:
+            logger.exception(f'Failed to write {len(events)} audit events; will retry')
+            with self._lock:
+                self._events = (events + self._events)[-self.max_buffered:]
+            return 0
+        return len(events)
+
+    def _run(self):
+        while True:
+            self._flush_requested.wait(self.flush_interval)
+            self._flush_requested.clear()
+            self.flush()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def _get_buffer():
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                config = settings.SLACK_PROVISIONING
+                _buffer = AuditBuffer(
+                    flush_size=config.get('audit_flush_size', DEFAULT_FLUSH_SIZE),
+                    flush_interval=config.get('audit_flush_interval', DEFAULT_FLUSH_INTERVAL),
+                    max_buffered=config.get('audit_max_buffered', DEFAULT_MAX_BUFFERED),
+                )
+                atexit.register(_buffer.flush)
+    return _buffer
+
+
+def record(action, detail=None, **fields):
+    """
+    Buffers an audit event; it's written to the database within audit_flush_interval seconds.
+    :param action: One of SlackAuditEvent.ACTION_CHOICES
+    :param detail: Optional JSON-serializable details, eg: the Slack error response.
+    :param fields: SlackAuditEvent fields (course_sis_id, team_id, univ_id, slack_user_id); missing ones are taken
+    from the current audit context.
+    """
+    values = dict(_audit_context.get(), tenant=get_current_tenant().name)
+    values.update((name, value) for name, value in fields.items() if value is not None)
+    event = SlackAuditEvent(action=action, detail=json.dumps(detail, default=str) if detail else '', **values)
+    _get_buffer().add(event)
+
+
+def flush():
+    """
+    Writes buffered audit events now, eg: at the end of a management command.
+    """
+    return _get_buffer().flush()
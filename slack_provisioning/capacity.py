@@ -0,0 +1,236 @@
+"""
+An offline model of how long term-start provisioning takes under Slack's per-method rate limits.
+
+Each course is provisioned by one staff member, after which every enrollment launches the tool, joins the
+workspace and (optionally) relaunches it. The Slack calls made by each of those steps mirror views.py. Every
+Slack method is modelled as a GCRA rate limiter with the budget of its tier from ratelimit.METHOD_TIERS: a call
+that arrives early is answered with a 429, and the client retries once Retry-After has elapsed.
+
+Besides caches, a configuration can batch reads: with 'coalesce', a team read (admin.teams.settings.info or
+admin.teams.admins.list) made while an identical one is in flight waits for that call instead of making its own,
+as slack_api._coalesced_get does. Coalescing is modelled as if one process served every course, so it's the most
+it can save; reads of a user's own account are never concurrent in the model and aren't coalesced. With
+'team_admins', a team's admin set is fetched once and shared by every staff launch until admin_cache_timeout
+expires, as slack_api.get_workspace_admin_ids does.
+"""
+import heapq
+import math
+import random
+from collections import Counter, namedtuple
+
+from .ratelimit import METHOD_TIERS, RATE_LIMIT_TIERS
+
+# Caching and batching configurations compared by the simulation; each names the lookups that are served from a
+# cache after the first call, plus 'coalesce' if identical concurrent team reads share one call.
+CACHE_CONFIGURATIONS = {
+    'none': frozenset(),
+    'scim': frozenset(['scim']),
+    'team': frozenset(['team_settings', 'team_admins']),
+    'admin_set': frozenset(['team_admins']),
+    'coalesce': frozenset(['coalesce']),
+    'all': frozenset(['scim', 'team_settings', 'team_admins', 'coalesce']),
+}
+
+# Team reads that 'coalesce' shares between concurrent sessions
+COALESCED_METHODS = frozenset(['admin.teams.settings.info', 'admin.teams.admins.list'])
+
+SimulationResult = namedtuple('SimulationResult', [
+    'configuration',
+    'calls',
+    'coalesced',
+    'rate_limited',
+    'makespan',
+    'session_p50',
+    'session_p95',
+    'method_calls',
+    'method_rate_limited',
+    'method_peak_queue',
+])
+
+
+class _MethodLimiter:
+    """
+    Generic cell rate algorithm for a single Slack method: allows `per_minute` calls per minute with a burst of
+    `burst_seconds` worth of calls.
+    """
+    def __init__(self, per_minute, burst_seconds):
+        self.interval = 60.0 / per_minute
+        self.tolerance = max(burst_seconds - self.interval, 0.0)
+        self.theoretical_arrival = 0.0
+
+    def reserve(self, now):
+        """
+        :return: The time the call is accepted and the number of calls already queued ahead of it.
+        """
+        earliest = self.theoretical_arrival - self.tolerance
+        start = max(now, earliest)
+        queued = math.ceil((earliest - now) / self.interval) if earliest > now else 0
+        self.theoretical_arrival = max(self.theoretical_arrival, start) + self.interval
+        return start, queued
+
+
+# Each call is (Slack method, the per-team lookup it makes or None); team lookups are served from the team's cache
+# when the configuration caches them, at the time the call is reached.
+
+def _provision_calls(new_user):
+    calls = [('scim.Users.get', None)]
+    if new_user:
+        calls.append(('scim.Users.create', None))
+    calls += [('admin.teams.create', None), ('admin.teams.settings.setIcon', None),
+              ('admin.teams.settings.info', 'team_settings'), ('admin.users.assign', None),
+              ('admin.users.setAdmin', None)]
+    return calls
+
+
+def _enrollment_calls(new_user, is_staff, relaunches, cached):
+    """
+    Calls made by one enrollment: a launch, a join and any later relaunches.
+    """
+    calls = [('scim.Users.get', None)]
+    if not new_user:
+        calls.append(('users.info', None))
+
+    if 'scim' not in cached:
+        calls.append(('scim.Users.get', None))
+    if new_user:
+        calls.append(('scim.Users.create', None))
+    calls.append(('users.info', None))
+    calls.append(('admin.teams.settings.info', 'team_settings'))
+    calls.append(('admin.users.assign', None))
+    if is_staff:
+        calls.append(('admin.users.setAdmin', None))
+
+    for _ in range(relaunches):
+        if 'scim' not in cached:
+            calls.append(('scim.Users.get', None))
+        calls.append(('users.info', None))
+        if is_staff:
+            calls.append(('admin.teams.admins.list', 'team_admins'))
+    return calls
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def simulate(courses, enrollments, configuration='none', staff_fraction=0.05, new_user_fraction=0.5,
+             relaunches=1, arrival_minutes=60.0, call_latency=0.3, burst_seconds=10.0, tier_limits=None,
+             admin_cache_timeout=300.0, seed=0):
+    """
+    Simulates term-start provisioning for one caching configuration.
+    :param courses: Number of courses that get a workspace.
+    :param enrollments: Total number of enrollments across those courses.
+    :param configuration: One of CACHE_CONFIGURATIONS.
+    :param staff_fraction: Fraction of enrollments that are teaching staff and get promoted to admin.
+    :param new_user_fraction: Fraction of users that don't have a Grid account yet.
+    :param relaunches: Number of times each user relaunches the tool after joining.
+    :param arrival_minutes: Provisioning and first launches are spread uniformly over this many minutes.
+    :param call_latency: Seconds each Slack call takes once it's accepted.
+    :param burst_seconds: How many seconds of budget Slack lets a method burst above its steady rate.
+    :param tier_limits: Overrides for RATE_LIMIT_TIERS, keyed by tier.
+    :param admin_cache_timeout: Seconds a team's cached admin set is shared for; team settings stay cached for the
+    whole run.
+    :param seed: Random seed, so runs are repeatable.
+    :return: A SimulationResult; times are in seconds.
+    """
+    cached = CACHE_CONFIGURATIONS[configuration]
+    coalesce = 'coalesce' in cached
+    lookup_timeouts = {'team_settings': math.inf, 'team_admins': admin_cache_timeout}
+    limits = dict(RATE_LIMIT_TIERS)
+    limits.update(tier_limits or {})
+    rng = random.Random(seed)
+    window = arrival_minutes * 60.0
+
+    limiters = {method: _MethodLimiter(limits[tier], burst_seconds) for method, tier in METHOD_TIERS.items()}
+    # team_caches[course][lookup] = (time the lookup's result is cached, time it expires)
+    team_caches = [{} for _ in range(courses)]
+    # (method, course) -> time the call in flight for it returns
+    in_flight = {}
+    coalesced = 0
+    method_calls = Counter()
+    method_rate_limited = Counter()
+    method_peak_queue = Counter()
+
+    # sessions[i] = [calls, next call index, start time, enrolled course, provisioned course]
+    sessions = []
+    events = []
+    waiting_for_course = [[] for _ in range(courses)]
+
+    for course in range(courses):
+        arrival = rng.uniform(0, window / 4)
+        sessions.append([_provision_calls(rng.random() < new_user_fraction), 0, arrival, None, course])
+        heapq.heappush(events, (arrival, len(sessions) - 1))
+
+    for enrollment in range(enrollments):
+        course = enrollment % courses
+        sessions.append([None, 0, rng.uniform(0, window), course, None])
+        waiting_for_course[course].append(len(sessions) - 1)
+
+    def start_enrollment(index, now):
+        session = sessions[index]
+        session[2] = max(session[2], now)
+        session[0] = _enrollment_calls(rng.random() < new_user_fraction, rng.random() < staff_fraction,
+                                       relaunches, cached)
+        heapq.heappush(events, (session[2], index))
+
+    durations = []
+    makespan = 0.0
+    while events:
+        now, index = heapq.heappop(events)
+        session = sessions[index]
+        calls, position = session[0], session[1]
+
+        if position == len(calls):
+            durations.append(now - session[2])
+            makespan = max(makespan, now)
+            provisioned_course = session[4]
+            if provisioned_course is not None:
+                # students who arrived before the workspace existed join as soon as it's ready
+                for waiting in waiting_for_course[provisioned_course]:
+                    start_enrollment(waiting, now)
+            continue
+
+        method, lookup = calls[position]
+        course = session[3] if session[3] is not None else session[4]
+        session[1] = position + 1
+        if lookup in cached:
+            cached_at, expires_at = team_caches[course].get(lookup, (math.inf, 0.0))
+            if cached_at <= now < expires_at:
+                heapq.heappush(events, (now, index))
+                continue
+        if coalesce and method in COALESCED_METHODS:
+            returns_at = in_flight.get((method, course), 0.0)
+            if returns_at > now:
+                coalesced += 1
+                heapq.heappush(events, (returns_at, index))
+                continue
+
+        start, queued = limiters[method].reserve(now)
+        method_calls[method] += 1
+        if start > now:
+            method_rate_limited[method] += 1
+            method_peak_queue[method] = max(method_peak_queue[method], queued)
+        returns_at = start + call_latency
+        if coalesce and method in COALESCED_METHODS:
+            in_flight[(method, course)] = returns_at
+        if lookup in cached:
+            team_caches[course][lookup] = (returns_at, returns_at + lookup_timeouts[lookup])
+        heapq.heappush(events, (returns_at, index))
+
+    calls = sum(method_calls.values())
+    rate_limited = sum(method_rate_limited.values())
+    return SimulationResult(
+        configuration=configuration,
+        calls=calls,
+        coalesced=coalesced,
+        rate_limited=rate_limited,
+        makespan=makespan,
+        session_p50=_percentile(durations, 0.5),
+        session_p95=_percentile(durations, 0.95),
+        method_calls=method_calls,
+        method_rate_limited=method_rate_limited,
+        method_peak_queue=method_peak_queue,
+    )
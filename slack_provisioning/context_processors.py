@@ -0,0 +1,20 @@
+from django.conf import settings
+
+SLACK_DOWNLOAD_URL = 'https://slack.com/download'
+
+# built on the first request and shared by every render after that
+_static_context = None
+
+
+def slack_provisioning(request):
+    """
+    Adds the template context that's the same for every request in this process.
+    """
+    global _static_context
+    if _static_context is None:
+        _static_context = {
+            'slack_download_url': SLACK_DOWNLOAD_URL,
+            'workspace_fragment_cache_timeout': settings.SLACK_PROVISIONING.get('workspace_fragment_cache_timeout',
+                                                                                300),
+        }
+    return _static_context
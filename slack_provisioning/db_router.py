@@ -0,0 +1,62 @@
+import contextvars
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+REPLICA_DATABASE = 'replica'
+
+APP_LABEL = 'slack_provisioning'
+
+# set once the current request (or command) has written, so its later reads see its own writes
+_pinned_to_primary = contextvars.ContextVar('pinned_to_primary', default=False)
+
+
+def pin_to_primary():
+    """
+    Sends the rest of the current request's reads to the primary database.
+    """
+    _pinned_to_primary.set(True)
+
+
+@contextmanager
+def routing_scope():
+    """
+    Starts a fresh read-your-writes scope, eg: for one request. Writes inside the block don't pin reads outside it.
+    """
+    token = _pinned_to_primary.set(False)
+    try:
+        yield
+    finally:
+        _pinned_to_primary.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Sends reads of this app's models to the read replica, if one is configured in settings.DATABASES, and writes
+    to the primary. After the first write in a routing scope, reads in that scope go to the primary as well.
+    """
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label != APP_LABEL or REPLICA_DATABASE not in settings.DATABASES:
+            return None
+        if _pinned_to_primary.get():
+            return DEFAULT_DB_ALIAS
+        return REPLICA_DATABASE
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label != APP_LABEL:
+            return None
+        pin_to_primary()
+        # rows read from the replica would otherwise be saved back to it
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replica holds the same rows as the primary
+        databases = {DEFAULT_DB_ALIAS, REPLICA_DATABASE}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return None
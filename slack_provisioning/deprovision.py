@@ -0,0 +1,96 @@
+"""
+Term-end deprovisioning: removes the members of a term's workspaces and archives the workspaces.
+
+Slack's admin API can't delete or archive a workspace, so archiving closes the workspace to new members and
+renames it. Progress lives in the database and in Slack itself: a workspace is marked "archiving" before any
+member is removed and "archived" once it's done. Each pass re-lists the remaining members, so an interrupted run
+resumes where it stopped when it's run again.
+"""
+import logging
+
+from django.db.models import Q
+from django.utils import timezone
+
+from . import audit, util
+from .models import SlackWorkspace
+from .slack_api import (SlackApiError, iter_workspace_users, remove_user_from_workspace, set_team_discoverability,
+                        set_team_name)
+from .tenants import use_tenant
+
+logger = logging.getLogger(__name__)
+
+ARCHIVED_NAME_SUFFIX = ' [archived]'
+
+
+def select_term_workspaces(term_name):
+    """
+    :param term_name: A Canvas term name, eg: "2019-2020 Fall"
+    :return: The workspaces created for the given term that haven't been archived yet, oldest first.
+    Workspaces are matched on their term_name, or for older rows on the term encoded in their team name.
+    """
+    term_filter = Q(term_name=term_name) | Q(team_name__contains=util.get_team_name_term_marker(term_name))
+    return (SlackWorkspace.objects
+            .filter(term_filter, status__in=['completed', 'archiving'])
+            .exclude(team_id__isnull=True)
+            .order_by('id'))
+
+
+def _removable(user, keep_admins):
+    if user.is_primary_owner:
+        return False
+    if keep_admins and (user.is_admin or user.is_owner):
+        return False
+    return True
+
+
+def deprovision_workspace(workspace, keep_admins=False, rename=True, page_size=100, dry_run=False):
+    """
+    Removes the members of one workspace, then closes and renames it and marks it archived.
+    Calls are made with the workspace's tenant, so they're paced by that tenant's rate limit budget.
+    :param keep_admins: Keep workspace admins and owners (eg: teaching staff) as members.
+    :param rename: Add ARCHIVED_NAME_SUFFIX to the workspace name.
+    :param dry_run: Only count the members that would be removed.
+    :return: The number of members removed (or that would be removed).
+    """
+    removed = 0
+    with use_tenant(workspace.tenant), audit.audit_context(course_sis_id=workspace.course_sis_id):
+        if dry_run:
+            return sum(1 for user in iter_workspace_users(workspace.team_id, page_size)
+                       if _removable(user, keep_admins))
+
+        if workspace.status != 'archiving':
+            workspace.status = 'archiving'
+            workspace.save(update_fields=['status'])
+
+        while True:
+            # removing users invalidates the listing cursor, so collect a full pass before removing anyone
+            pending = [user.id for user in iter_workspace_users(workspace.team_id, page_size)
+                       if _removable(user, keep_admins)]
+            if not pending:
+                break
+            for user_id in pending:
+                response_data = remove_user_from_workspace(workspace.team_id, user_id)
+                if response_data.get('ok'):
+                    removed += 1
+                else:
+                    raise SlackApiError(f'Error removing {user_id} from {workspace.team_id}: {response_data}')
+            workspace.members.filter(slack_user_id__in=pending).delete()
+            logger.info(f'Removed {len(pending)} members from {workspace.team_id}')
+
+        response_data = set_team_discoverability(workspace.team_id, 'closed')
+        if not response_data.get('ok'):
+            logger.warning(f'Could not close {workspace.team_id} to new members: {response_data}')
+        if rename and not workspace.team_name.endswith(ARCHIVED_NAME_SUFFIX):
+            team_name = workspace.team_name[:100 - len(ARCHIVED_NAME_SUFFIX)] + ARCHIVED_NAME_SUFFIX
+            response_data = set_team_name(workspace.team_id, team_name)
+            if response_data.get('ok'):
+                workspace.team_name = team_name
+            else:
+                logger.warning(f'Could not rename {workspace.team_id} to {team_name}: {response_data}')
+
+        workspace.status = 'archived'
+        workspace.archived_at = timezone.now()
+        workspace.save(update_fields=['status', 'archived_at', 'team_name'])
+        audit.record('workspace_archived', team_id=workspace.team_id, detail={'members_removed': removed})
+
+    return removed
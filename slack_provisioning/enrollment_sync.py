@@ -0,0 +1,246 @@
+"""
+Nightly enrollment sync from Canvas SIS exports.
+
+Each export (a directory or .zip holding enrollments.csv and, optionally, users.csv) lists the enrollments that
+were added, dropped or changed. Only courses with a completed SlackWorkspace are considered, and each is compared
+with the SlackWorkspaceMember rows of the users the export mentions, so the work done scales with the size of the
+export rather than with total enrollment:
+
+* active enrollments of users who aren't members are assigned to the workspace (and made admins if staff)
+* active staff enrollments of users who are regular members make them admins
+* dropped enrollments of members remove them from the workspace, unless the same export has an active
+  enrollment for them in the course (eg: a section change)
+
+Members are never demoted; a delta can't tell a role change from an added section.
+
+Exports are applied in name order, and the name of the last one applied in full is kept as the high-water mark
+in SlackSyncState, so each run only picks up exports it hasn't seen. Member rows are written as each change is
+made, so re-running an export that was interrupted only makes the changes that are still missing.
+"""
+import csv
+import io
+import logging
+import os
+import zipfile
+from contextlib import contextmanager
+
+from . import audit, util
+from .models import SlackSyncState, SlackWorkspace, SlackWorkspaceMember
+from .slack_api import (SlackApiError, assign_user_to_workspace, get_default_workspace_channels,
+                        get_scim_user_by_email, remove_user_from_workspace, set_workspace_admin)
+from .tenants import use_tenant
+
+logger = logging.getLogger(__name__)
+
+SYNC_STATE_NAME = 'enrollments'
+
+# Canvas SIS enrollment roles, as the LTI roles util.is_user_staff and util.is_user_in_class expect
+SIS_ROLES = {
+    'student': 'Learner',
+    'teacher': 'Instructor',
+    'ta': 'TA',
+    'designer': 'Designer',
+}
+
+ACTIVE_STATUSES = ('active',)
+DROPPED_STATUSES = ('deleted', 'inactive')
+
+
+class CourseDelta:
+    __slots__ = ('course_sis_id', 'active', 'dropped')
+
+    def __init__(self, course_sis_id):
+        self.course_sis_id = course_sis_id
+        # univ_id -> True if any of the user's active enrollments is a staff role
+        self.active = {}
+        self.dropped = set()
+
+
+class SyncResult:
+    __slots__ = ('added', 'promoted', 'removed', 'unresolved', 'failed')
+
+    def __init__(self):
+        self.added = self.promoted = self.removed = self.unresolved = self.failed = 0
+
+    def merge(self, other):
+        for name in self.__slots__:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+    def __str__(self):
+        return ', '.join(f'{getattr(self, name)} {name}' for name in self.__slots__)
+
+
+@contextmanager
+def _open_export_file(export_path, name):
+    """
+    Opens the given member of an export directory or zip as text.
+    :return: The open file, or None if it's not there.
+    """
+    if zipfile.is_zipfile(export_path):
+        with zipfile.ZipFile(export_path) as archive:
+            if name not in archive.namelist():
+                yield None
+                return
+            with io.TextIOWrapper(archive.open(name), encoding='utf-8-sig', newline='') as export_file:
+                yield export_file
+        return
+    path = os.path.join(export_path, name)
+    if not os.path.exists(path):
+        yield None
+        return
+    with open(path, encoding='utf-8-sig', newline='') as export_file:
+        yield export_file
+
+
+def read_export(export_path):
+    """
+    :return: A CourseDelta per course in the export's enrollments.csv, and the email of each user in its users.csv
+    """
+    deltas = {}
+    with _open_export_file(export_path, 'enrollments.csv') as enrollments_file:
+        if enrollments_file is None:
+            raise ValueError(f'{export_path} has no enrollments.csv')
+        for row in csv.DictReader(enrollments_file):
+            course_sis_id, univ_id = row.get('course_id'), row.get('user_id')
+            lti_role = SIS_ROLES.get(row.get('role', '').lower())
+            if not course_sis_id or not univ_id or not lti_role:
+                continue
+            delta = deltas.get(course_sis_id)
+            if delta is None:
+                delta = deltas[course_sis_id] = CourseDelta(course_sis_id)
+            status = row.get('status', '').lower()
+            if status in ACTIVE_STATUSES:
+                delta.active[univ_id] = delta.active.get(univ_id, False) or util.is_user_staff([lti_role])
+            elif status in DROPPED_STATUSES:
+                delta.dropped.add(univ_id)
+
+    emails = {}
+    with _open_export_file(export_path, 'users.csv') as users_file:
+        if users_file is not None:
+            emails = {row['user_id']: row['email'] for row in csv.DictReader(users_file) if row.get('email')}
+    return deltas, emails
+
+
+def _known_slack_user_ids(univ_ids):
+    """
+    :return: The Slack user ids already recorded for any of the given users, in any workspace.
+    """
+    return dict(SlackWorkspaceMember.objects
+                .filter(univ_id__in=univ_ids, slack_user_id__isnull=False)
+                .values_list('univ_id', 'slack_user_id'))
+
+
+def apply_course_delta(workspace, delta, emails, dry_run=False):
+    """
+    Makes the Slack and database changes for one course's delta.
+    :param emails: univ_id -> email, used to find the Slack accounts of users who aren't members of any workspace.
+    Users without a Slack account are left for their first launch, where they agree to activate one.
+    """
+    result = SyncResult()
+    touched = set(delta.active) | delta.dropped
+    members = {member.univ_id: member for member in workspace.members.filter(univ_id__in=touched)}
+
+    adds = set(delta.active) - set(members)
+    promotions = {univ_id for univ_id in set(delta.active) & set(members)
+                  if delta.active[univ_id] and members[univ_id].membership_type == 'regular'}
+    drops = (delta.dropped - set(delta.active)) & set(members)
+    if dry_run:
+        result.added, result.promoted, result.removed = len(adds), len(promotions), len(drops)
+        return result
+
+    with use_tenant(workspace.tenant), audit.audit_context(course_sis_id=workspace.course_sis_id):
+        if adds:
+            slack_user_ids = _known_slack_user_ids(adds)
+            default_channels = get_default_workspace_channels(team_id=workspace.team_id)
+        for univ_id in sorted(adds):
+            slack_user_id = slack_user_ids.get(univ_id)
+            if slack_user_id is None:
+                scim_user = get_scim_user_by_email(emails[univ_id]) if univ_id in emails else None
+                if scim_user is None:
+                    # they'll be assigned when they launch the tool and activate their Grid account there
+                    result.unresolved += 1
+                    continue
+                slack_user_id = scim_user.id
+            response_data = assign_user_to_workspace(team_id=workspace.team_id, user_id=slack_user_id,
+                                                     channel_ids=default_channels)
+            if not response_data or not response_data.get('ok'):
+                audit.record('user_assignment_failed', team_id=workspace.team_id, univ_id=univ_id,
+                             slack_user_id=slack_user_id, detail=response_data)
+                result.failed += 1
+                continue
+            audit.record('user_assigned', team_id=workspace.team_id, univ_id=univ_id, slack_user_id=slack_user_id)
+            membership_type = 'regular'
+            if delta.active[univ_id]:
+                response_data = set_workspace_admin(team_id=workspace.team_id, user_id=slack_user_id)
+                if response_data.get('ok'):
+                    membership_type = 'admin'
+                else:
+                    # kept as a regular member, so a later export's promotion retries it
+                    result.failed += 1
+            SlackWorkspaceMember.objects.create(slack_workspace=workspace, univ_id=univ_id,
+                                                slack_user_id=slack_user_id, membership_type=membership_type)
+            result.added += 1
+
+        for univ_id in sorted(promotions):
+            member = members[univ_id]
+            response_data = set_workspace_admin(team_id=workspace.team_id, user_id=member.slack_user_id)
+            if not response_data.get('ok'):
+                result.failed += 1
+                continue
+            member.membership_type = 'admin'
+            member.save(update_fields=['membership_type'])
+            result.promoted += 1
+
+        for univ_id in sorted(drops):
+            member = members[univ_id]
+            response_data = remove_user_from_workspace(workspace.team_id, member.slack_user_id)
+            if not response_data.get('ok'):
+                logger.warning(f'Could not remove {member.slack_user_id} from {workspace.team_id}: {response_data}')
+                result.failed += 1
+                continue
+            member.delete()
+            result.removed += 1
+
+    return result
+
+
+def sync_export(export_path, dry_run=False):
+    """
+    Applies one export to every course in it that has a completed workspace.
+    :return: A SyncResult with the changes made (or that would be made, for a dry run).
+    """
+    deltas, emails = read_export(export_path)
+    result = SyncResult()
+    workspaces = (SlackWorkspace.objects.active()
+                  .filter(status='completed', course_sis_id__in=list(deltas))
+                  .exclude(team_id__isnull=True))
+    for workspace in workspaces.iterator():
+        try:
+            course_result = apply_course_delta(workspace, deltas[workspace.course_sis_id], emails, dry_run)
+        except SlackApiError as e:
+            logger.error(f'Error syncing enrollments of {workspace.course_sis_id} ({workspace.team_id}): {e}')
+            course_result = SyncResult()
+            course_result.failed = 1
+        logger.info(f'Synced {os.path.basename(export_path)} to {workspace.course_sis_id}: {course_result}')
+        result.merge(course_result)
+    return result
+
+
+def get_high_water_mark():
+    state = SlackSyncState.objects.filter(name=SYNC_STATE_NAME).first()
+    return state.high_water_mark if state else ''
+
+
+def set_high_water_mark(value):
+    SlackSyncState.objects.update_or_create(name=SYNC_STATE_NAME, defaults={'high_water_mark': value})
+
+
+def pending_exports(export_dir, high_water_mark=None):
+    """
+    :return: Paths of the exports in export_dir named after the high-water mark, in name order.
+    """
+    if high_water_mark is None:
+        high_water_mark = get_high_water_mark()
+    names = sorted(name for name in os.listdir(export_dir)
+                   if not name.startswith('.') and name > high_water_mark)
+    return [os.path.join(export_dir, name) for name in names]
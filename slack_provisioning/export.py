@@ -0,0 +1,88 @@
+import csv
+import json
+import logging
+
+from django.db.models import Count
+
+from .models import SlackWorkspace, SlackWorkspaceMember
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ('csv', 'jsonl')
+
+# rows fetched per round trip; on PostgreSQL iterator() uses a server-side cursor so only one chunk is held in memory
+EXPORT_CHUNK_SIZE = 2000
+
+WORKSPACE_EXPORT_FIELDS = (
+    'id',
+    'tenant',
+    'course_sis_id',
+    'term_name',
+    'team_id',
+    'team_domain',
+    'team_name',
+    'status',
+    'created_by',
+    'created_at',
+    'member_count',
+)
+
+MEMBER_EXPORT_FIELDS = (
+    'id',
+    'slack_workspace__course_sis_id',
+    'slack_workspace__team_id',
+    'univ_id',
+    'slack_user_id',
+    'membership_type',
+    'created_at',
+)
+
+
+class _Echo:
+    """
+    A file-like object that returns what is written to it, so csv.writer can produce one line at a time.
+    """
+    def write(self, value):
+        return value
+
+
+def _workspace_rows():
+    queryset = SlackWorkspace.objects.order_by().annotate(member_count=Count('members'))
+    return queryset.values_list(*WORKSPACE_EXPORT_FIELDS).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+def _member_rows():
+    queryset = SlackWorkspaceMember.objects.order_by()
+    return queryset.values_list(*MEMBER_EXPORT_FIELDS).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+EXPORTS = {
+    'workspaces': (WORKSPACE_EXPORT_FIELDS, _workspace_rows),
+    'members': (MEMBER_EXPORT_FIELDS, _member_rows),
+}
+
+
+def export_lines(kind, export_format='csv'):
+    """
+    Generates the workspace or member table as CSV or JSON Lines, one line at a time.
+    Rows are streamed from the database in chunks, so memory use is constant regardless of table size.
+    :param kind: Either "workspaces" or "members"
+    :param export_format: Either "csv" or "jsonl"
+    :return: A generator of newline-terminated strings, starting with a header line for CSV.
+    """
+    if kind not in EXPORTS:
+        raise ValueError(f'Unknown export kind: {kind}')
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f'Unknown export format: {export_format}')
+
+    fields, rows = EXPORTS[kind]
+    logger.info(f'Starting {export_format} export of {kind}')
+
+    if export_format == 'csv':
+        writer = csv.writer(_Echo())
+        yield writer.writerow(fields)
+        for row in rows():
+            yield writer.writerow(row)
+    else:
+        for row in rows():
+            yield json.dumps(dict(zip(fields, row)), default=str) + '\n'
@@ -0,0 +1,66 @@
+import statistics
+import time
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand
+from django.template import engines
+from django.template.loader import render_to_string
+from django.test import RequestFactory
+from django.utils.text import compress_string
+
+from slack_provisioning.models import SlackWorkspace
+
+# Context the launch view builds for each of the states the page can show
+SCENARIOS = {
+    'no workspace (staff)': {
+        'slack_workspace': None,
+        'user_is_staff': True,
+        'workspace_member': False,
+        'existing_slack_user': True,
+    },
+    'completed, not a member': {
+        'slack_workspace': SlackWorkspace(pk=1, team_domain='cs-50-f20-abc', team_name='CS 50 (Fa 20) 123456',
+                                          status='completed'),
+        'user_is_staff': False,
+        'workspace_member': False,
+        'existing_slack_user': False,
+    },
+    'completed, member': {
+        'slack_workspace': SlackWorkspace(pk=1, team_domain='cs-50-f20-abc', team_name='CS 50 (Fa 20) 123456',
+                                          status='completed'),
+        'user_is_staff': False,
+        'workspace_member': True,
+        'existing_slack_user': True,
+    },
+}
+
+
+class Command(BaseCommand):
+    help = ('Measures the time to render the LTI launch page, and its size with and without compression, for '
+            'each state the page can be in. Uses the template loaders and caches configured in settings.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        loaders = [loader.__class__.__module__ for loader in engines['django'].engine.template_loaders]
+        self.stdout.write(f'Template loaders: {", ".join(loaders)}')
+
+        request = RequestFactory().post('/slack_provisioning/lti_launch/')
+        request.user = AnonymousUser()
+
+        for name, context in SCENARIOS.items():
+            context = dict(context, course_sis_id='123456', univ_id='12345678', user_email='student@example.edu')
+            timings = []
+            for _ in range(options['iterations']):
+                started = time.perf_counter()
+                content = render_to_string('slack_provisioning/lti_launch.html', context, request=request)
+                timings.append(time.perf_counter() - started)
+
+            body = content.encode()
+            first = timings[0]
+            timings.sort()
+            self.stdout.write(f'{name:<26} mean {statistics.mean(timings) * 1000:6.2f} ms  '
+                              f'p95 {timings[int(len(timings) * 0.95)] * 1000:6.2f} ms  '
+                              f'first {first * 1000:6.2f} ms  '
+                              f'size {len(body):6d} B  gzip {len(compress_string(body)):5d} B')
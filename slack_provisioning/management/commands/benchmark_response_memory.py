@@ -0,0 +1,116 @@
+import gc
+import json
+import pickle
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from slack_provisioning.slack_types import ScimUser, TeamSettings, WorkspaceUser
+
+
+def _workspace_user(n):
+    # shaped like an admin.users.list user
+    return {
+        'id': f'W{n:010d}',
+        'email': f'student{n}@college.harvard.edu',
+        'is_admin': n % 50 == 0,
+        'is_owner': False,
+        'is_primary_owner': False,
+        'is_restricted': False,
+        'is_ultra_restricted': False,
+        'is_bot': False,
+        'username': f'student{n}',
+        'full_name': f'Student Number {n}',
+        'date_created': 1600000000 + n,
+        'has_2fa': False,
+        'workspaces': [f'T{n % 1000:010d}'],
+        'roles': [{'name': 'member', 'id': 'Rl0A'}],
+    }
+
+
+def _scim_user(n):
+    # shaped like a SCIM Users resource
+    return {
+        'schemas': ['urn:scim:schemas:core:1.0'],
+        'id': f'W{n:010d}',
+        'externalId': '',
+        'meta': {'created': '2020-09-01T12:00:00-04:00', 'location': f'https://api.slack.com/scim/v1/Users/W{n:010d}'},
+        'userName': f'student{n}',
+        'nickName': f'student{n}',
+        'name': {'givenName': 'Student', 'familyName': f'Number {n}'},
+        'displayName': f'Student Number {n}',
+        'profileUrl': f'https://harvard.enterprise.slack.com/team/student{n}',
+        'title': '',
+        'timezone': 'America/New_York',
+        'active': True,
+        'emails': [{'value': f'student{n}@college.harvard.edu', 'primary': True}],
+        'photos': [{'value': 'https://secure.gravatar.com/avatar/0.jpg', 'type': 'photo'}],
+        'groups': [],
+    }
+
+
+def _team(n):
+    # shaped like an admin.teams.settings.info team
+    return {
+        'id': f'T{n:010d}',
+        'name': f'COURSE {n} (Fa20) {n}',
+        'domain': f'course-{n}-fa20',
+        'email_domain': '',
+        'icon': {'image_34': 'https://a.slack-edge.com/0.png', 'image_default': True},
+        'enterprise_id': 'E0000000001',
+        'enterprise_name': 'Harvard University',
+        'default_channels': [f'C{n:09d}1', f'C{n:09d}2'],
+        'discoverability': 'unlisted',
+    }
+
+
+# response shape, typed model, and how many objects to build as a fraction of --users
+DATASETS = {
+    'admin.users.list': (_workspace_user, WorkspaceUser, 1),
+    'scim.Users.get': (_scim_user, ScimUser, 1),
+    'admin.teams.settings.info': (_team, TeamSettings, 0.02),
+}
+
+
+def _measure(build):
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    objects = build()
+    elapsed = time.perf_counter() - started
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return objects, retained, peak, elapsed
+
+
+class Command(BaseCommand):
+    help = ('Compares the memory held by raw Slack API response dicts and by the compact models in slack_types, '
+            'and the size of each when pickled into the cache. Runs offline on generated responses.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50000)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'{"response":<28}{"form":<8}{"objects":>8}{"retained MB":>13}{"peak MB":>10}'
+                          f'{"pickled MB":>12}{"parse s":>9}')
+        for name, (make_response, model, fraction) in DATASETS.items():
+            count = max(1, int(options['users'] * fraction))
+            payload = json.dumps([make_response(n) for n in range(count)])
+
+            raw, raw_retained, raw_peak, raw_elapsed = _measure(lambda: json.loads(payload))
+            raw_pickled = len(pickle.dumps(raw, pickle.HIGHEST_PROTOCOL))
+            del raw
+
+            typed, retained, peak, elapsed = _measure(
+                lambda: [model.from_api(item) for item in json.loads(payload)])
+            pickled = len(pickle.dumps(typed, pickle.HIGHEST_PROTOCOL))
+            del typed
+
+            mb = 1024 * 1024
+            self.stdout.write(f'{name:<28}{"raw":<8}{count:>8}{raw_retained / mb:>13.1f}{raw_peak / mb:>10.1f}'
+                              f'{raw_pickled / mb:>12.1f}{raw_elapsed:>9.2f}')
+            self.stdout.write(f'{"":<28}{"typed":<8}{count:>8}{retained / mb:>13.1f}{peak / mb:>10.1f}'
+                              f'{pickled / mb:>12.1f}{elapsed:>9.2f}')
+            self.stdout.write(f'{"":<28}typed retains {retained / raw_retained:.0%} of the raw memory, '
+                              f'pickles to {pickled / raw_pickled:.0%} of the raw size')
@@ -0,0 +1,92 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Run in a fresh interpreter for each simulated worker: load the WSGI application the way gunicorn does, serve
+# one request, then report timings and memory use as JSON on stdout.
+WORKER_SCRIPT = """
+import io, json, resource, sys, time
+started = time.perf_counter()
+from slack_lti_tool.wsgi import application
+loaded = time.perf_counter()
+environ = {
+    'REQUEST_METHOD': 'GET', 'PATH_INFO': sys.argv[1], 'QUERY_STRING': '', 'SERVER_NAME': sys.argv[2],
+    'SERVER_PORT': '443', 'HTTP_HOST': sys.argv[2], 'wsgi.url_scheme': 'https', 'wsgi.input': io.BytesIO(),
+    'wsgi.errors': sys.stderr, 'wsgi.version': (1, 0), 'wsgi.multithread': False, 'wsgi.multiprocess': True,
+    'wsgi.run_once': False,
+}
+statuses = []
+body = b''.join(application(environ, lambda status, headers, exc_info=None: statuses.append(status)))
+responded = time.perf_counter()
+with open('/proc/self/statm') as statm:
+    rss_pages = int(statm.read().split()[1])
+print(json.dumps({
+    'load': loaded - started,
+    'first_request': responded - started,
+    'status': statuses[0],
+    'rss_mb': rss_pages * resource.getpagesize() / 2 ** 20,
+    'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'modules': len(sys.modules),
+}))
+"""
+
+
+class Command(BaseCommand):
+    help = ('Measures worker cold start: the time to load the WSGI application and serve a first request, and '
+            'the resident memory of the worker afterwards. Each worker runs in a fresh interpreter.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=5, help='Number of cold starts to measure.')
+        parser.add_argument('--path', default='/slack_provisioning/tool_config/',
+                            help='Path of the first request; it should not need an LTI launch.')
+        parser.add_argument('--host', default='localhost', help='Host header; must be in ALLOWED_HOSTS.')
+        parser.add_argument('--import-profile', type=int, default=0, metavar='N',
+                            help='Also list the N slowest imports (cumulative) from one more cold start.')
+
+    def handle(self, *args, **options):
+        if not sys.platform.startswith('linux'):
+            raise CommandError('benchmark_startup reads worker memory from /proc and only runs on Linux')
+
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE',
+                                                                    'slack_lti_tool.settings'))
+        command = [sys.executable, '-c', WORKER_SCRIPT, options['path'], options['host']]
+
+        runs = []
+        for _ in range(options['workers']):
+            result = subprocess.run(command, cwd=settings.BASE_DIR, env=env, stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE, universal_newlines=True)
+            if result.returncode != 0:
+                raise CommandError(f'Worker failed to start:\n{result.stderr}')
+            runs.append(json.loads(result.stdout.strip().splitlines()[-1]))
+
+        self.stdout.write(f'First request status: {runs[0]["status"]}')
+        for label, key, scale, unit in [('Application load', 'load', 1000, 'ms'),
+                                        ('Time to first request', 'first_request', 1000, 'ms'),
+                                        ('RSS after first request', 'rss_mb', 1, 'MB'),
+                                        ('Peak RSS', 'max_rss_mb', 1, 'MB'),
+                                        ('Modules loaded', 'modules', 1, '')]:
+            values = [run[key] * scale for run in runs]
+            self.stdout.write(f'{label:<25} median {statistics.median(values):8.1f} {unit:<3} '
+                              f'min {min(values):8.1f}  max {max(values):8.1f}')
+
+        if options['import_profile']:
+            self._import_profile(command, env, options['import_profile'])
+
+    def _import_profile(self, command, env, count):
+        result = subprocess.run([command[0], '-X', 'importtime'] + command[1:], cwd=settings.BASE_DIR, env=env,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        imports = []
+        for line in result.stderr.splitlines():
+            if line.startswith('import time:') and '|' in line:
+                _, cumulative, module = line[len('import time:'):].split('|')
+                if cumulative.strip().isdigit():
+                    imports.append((int(cumulative), module.rstrip()))
+
+        self.stdout.write('\nSlowest imports (cumulative):')
+        for cumulative, module in sorted(imports, reverse=True)[:count]:
+            self.stdout.write(f'{cumulative / 1000:8.1f} ms {module}')
@@ -0,0 +1,53 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from slack_provisioning import audit
+from slack_provisioning.deprovision import deprovision_workspace, select_term_workspaces
+from slack_provisioning.ratelimit import batch_priority, process_local_cache_warning
+from slack_provisioning.slack_api import SlackApiError
+
+
+class Command(BaseCommand):
+    help = ('Removes the members of every workspace created for the given term and archives the workspaces. '
+            'Calls are paced by the Slack rate limits; an interrupted run resumes when run again.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('term_name', help='Canvas term name, eg: "2019-2020 Fall"')
+        parser.add_argument('--keep-admins', action='store_true',
+                            help='Leave workspace admins and owners (eg: teaching staff) in the workspaces.')
+        parser.add_argument('--no-rename', dest='rename', action='store_false',
+                            help="Don't mark the workspace names as archived.")
+        parser.add_argument('--limit', type=int, help='Process at most this many workspaces.')
+        parser.add_argument('--page-size', type=int, default=100)
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be removed.')
+
+    def handle(self, *args, **options):
+        cache_warning = process_local_cache_warning()
+        if cache_warning:
+            self.stderr.write(self.style.WARNING(cache_warning))
+
+        workspaces = select_term_workspaces(options['term_name'])
+        if options['limit']:
+            workspaces = workspaces[:options['limit']]
+
+        started = time.monotonic()
+        total_removed = failed = 0
+        for count, workspace in enumerate(workspaces.iterator(), start=1):
+            try:
+                # yield the shared Slack budget to launches and joins
+                with batch_priority():
+                    removed = deprovision_workspace(workspace, keep_admins=options['keep_admins'],
+                                                    rename=options['rename'], page_size=options['page_size'],
+                                                    dry_run=options['dry_run'])
+            except SlackApiError as e:
+                failed += 1
+                self.stderr.write(f'{workspace.course_sis_id} ({workspace.team_id}): {e}; will resume on next run')
+                continue
+            total_removed += removed
+            verb = 'would remove' if options['dry_run'] else 'removed'
+            self.stdout.write(f'[{count}] {workspace.course_sis_id} ({workspace.team_id}): {verb} {removed} members '
+                              f'({time.monotonic() - started:.0f}s elapsed)')
+
+        audit.flush()
+        self.stdout.write(self.style.SUCCESS(f'Done: {total_removed} members, {failed} workspaces failed'))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from slack_provisioning.export import EXPORT_FORMATS, EXPORTS, export_lines
+
+
+class Command(BaseCommand):
+    help = 'Streams the Slack workspace or workspace member table to a CSV or JSON Lines file in constant memory.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(EXPORTS))
+        parser.add_argument('--format', dest='export_format', choices=EXPORT_FORMATS, default='csv')
+        parser.add_argument('--output', help='File to write to; defaults to stdout.')
+
+    def handle(self, *args, **options):
+        lines = export_lines(options['kind'], options['export_format'])
+        if options['output']:
+            with open(options['output'], 'w', newline='') as output:
+                output.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
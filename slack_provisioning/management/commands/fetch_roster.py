@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from slack_provisioning.models import SlackWorkspace
+from slack_provisioning.roster import MembershipClient, RosterError, client_for_workspace
+
+
+class Command(BaseCommand):
+    help = ("Reads a course roster from the LTI membership service, using the URL saved from the course's last "
+            "launch or a given URL (eg: a local stub), and reports the members the tool would admit.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('course_sis_id', nargs='?')
+        parser.add_argument('--url', help='Membership service URL to read instead of the course\'s.')
+        parser.add_argument('--consumer-key', help='LTI consumer key to sign requests to --url with.')
+        parser.add_argument('--page-size', type=int, default=100)
+        parser.add_argument('--no-cache', dest='use_cache', action='store_false',
+                            help="Read every page even if the cached roster is unchanged.")
+        parser.add_argument('--list', action='store_true', help='Print each member.')
+
+    def handle(self, *args, **options):
+        if options['url']:
+            if not options['consumer_key']:
+                raise CommandError('--url needs --consumer-key')
+            client = MembershipClient(options['url'], consumer_key=options['consumer_key'],
+                                      page_size=options['page_size'])
+        elif options['course_sis_id']:
+            slack_workspace = SlackWorkspace.objects.active().filter(course_sis_id=options['course_sis_id']).first()
+            client = client_for_workspace(slack_workspace) if slack_workspace else None
+            if client is None:
+                raise CommandError(f'No membership URL has been saved for {options["course_sis_id"]}; launch the '
+                                   f'tool from the course first')
+            client.page_size = options['page_size']
+        else:
+            raise CommandError('Give a course SIS id or --url')
+
+        started = time.monotonic()
+        members = staff = 0
+        try:
+            for member in client.iter_members(use_cache=options['use_cache']):
+                members += 1
+                staff += member.is_staff
+                if options['list']:
+                    self.stdout.write(f'{member.univ_id or "-":<12}{member.email or "-":<40}{",".join(member.roles)}')
+        except RosterError as e:
+            raise CommandError(str(e))
+        self.stdout.write(f'{members} members ({staff} staff) in {time.monotonic() - started:.2f}s')
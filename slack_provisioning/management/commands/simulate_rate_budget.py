@@ -0,0 +1,70 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from slack_provisioning.capacity import CACHE_CONFIGURATIONS, simulate
+
+
+def _tier_limit(value):
+    tier, _, per_minute = value.partition('=')
+    tier = int(tier) if tier.isdigit() else tier
+    return tier, int(per_minute)
+
+
+class Command(BaseCommand):
+    help = ('Estimates term-start provisioning time, 429 probability and queue depths under the Slack rate '
+            'limit tiers, for each caching and batching configuration (coalesced team reads, a shared admin set). '
+            'Runs offline; no Slack calls are made.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--courses', type=int, default=1000)
+        parser.add_argument('--enrollments', type=int, default=50000)
+        parser.add_argument('--configuration', action='append', choices=sorted(CACHE_CONFIGURATIONS),
+                            help='Configuration to simulate; may be repeated. Defaults to all of them.')
+        parser.add_argument('--staff-fraction', type=float, default=0.05)
+        parser.add_argument('--new-user-fraction', type=float, default=0.5)
+        parser.add_argument('--relaunches', type=int, default=1)
+        parser.add_argument('--arrival-minutes', type=float, default=60.0)
+        parser.add_argument('--call-latency', type=float, default=0.3, help='Seconds per accepted Slack call.')
+        parser.add_argument('--burst-seconds', type=float, default=10.0)
+        parser.add_argument('--tier-limit', type=_tier_limit, action='append', default=[],
+                            help='Override a tier budget in calls per minute, eg: --tier-limit 2=30')
+        parser.add_argument('--admin-cache-timeout', type=float,
+                            default=settings.SLACK_PROVISIONING.get('admin_cache_timeout', 300),
+                            help="Seconds a team's admin set is shared between staff launches.")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if options['courses'] < 1:
+            raise CommandError('--courses must be at least 1')
+
+        for configuration in options['configuration'] or sorted(CACHE_CONFIGURATIONS):
+            started = time.perf_counter()
+            result = simulate(
+                courses=options['courses'],
+                enrollments=options['enrollments'],
+                configuration=configuration,
+                staff_fraction=options['staff_fraction'],
+                new_user_fraction=options['new_user_fraction'],
+                relaunches=options['relaunches'],
+                arrival_minutes=options['arrival_minutes'],
+                call_latency=options['call_latency'],
+                burst_seconds=options['burst_seconds'],
+                tier_limits=dict(options['tier_limit']),
+                admin_cache_timeout=options['admin_cache_timeout'],
+                seed=options['seed'],
+            )
+            elapsed = time.perf_counter() - started
+
+            self.stdout.write(self.style.MIGRATE_HEADING(f'Configuration: {configuration}'))
+            self.stdout.write(f'  makespan: {result.makespan / 3600:.2f} h   '
+                              f'session p50: {result.session_p50 / 60:.1f} min   '
+                              f'session p95: {result.session_p95 / 60:.1f} min')
+            self.stdout.write(f'  calls: {result.calls}   coalesced: {result.coalesced}   429 probability: '
+                              f'{result.rate_limited / max(result.calls, 1):.3f}   '
+                              f'(simulated in {elapsed:.1f}s)')
+            self.stdout.write(f'  {"method":<30}{"calls":>9}{"429s":>9}{"peak queue":>12}')
+            for method, calls in result.method_calls.most_common():
+                self.stdout.write(f'  {method:<30}{calls:>9}{result.method_rate_limited[method]:>9}'
+                                  f'{result.method_peak_queue[method]:>12}')
@@ -0,0 +1,67 @@
+import glob
+import io
+import json
+import os
+import pstats
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+
+from slack_provisioning.profiling import get_profile_dir, make_profile_token
+
+
+class Command(BaseCommand):
+    help = ('Summarizes the request profiles collected by ProfilingMiddleware: the hottest functions across all '
+            'profiles and the time spent in each Slack method.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', help='Profile directory; defaults to the profile_dir setting.')
+        parser.add_argument('--view', help='Only include profiles of this view, eg: lti_launch')
+        parser.add_argument('--sort', choices=['cumulative', 'tottime', 'ncalls'], default='cumulative')
+        parser.add_argument('--limit', type=int, default=25, help='Number of functions to list.')
+        parser.add_argument('--make-token', action='store_true',
+                            help='Print a value for the X-Slack-Tool-Profile header instead.')
+
+    def handle(self, *args, **options):
+        if options['make_token']:
+            self.stdout.write(make_profile_token())
+            return
+
+        profile_dir = options['dir'] or get_profile_dir()
+        pattern = f'*-{options["view"]}-*.prof' if options['view'] else '*.prof'
+        profiles = sorted(glob.glob(os.path.join(profile_dir, pattern)))
+        if not profiles:
+            raise CommandError(f'No profiles found in {profile_dir}')
+
+        self._summarize_requests(profiles)
+
+        output = io.StringIO()
+        stats = pstats.Stats(*profiles, stream=output)
+        stats.strip_dirs().sort_stats(options['sort']).print_stats(options['limit'])
+        self.stdout.write(output.getvalue())
+
+    def _summarize_requests(self, profiles):
+        elapsed = []
+        slack_methods = defaultdict(lambda: [0, 0.0, 0.0])
+        for profile in profiles:
+            try:
+                with open(profile[:-len('.prof')] + '.json') as summary_file:
+                    summary = json.load(summary_file)
+            except (OSError, ValueError):
+                continue
+            elapsed.append(summary['elapsed'])
+            for call in summary['slack_calls']:
+                totals = slack_methods[call['method']]
+                totals[0] += 1
+                totals[1] += call['wait']
+                totals[2] += call['seconds']
+
+        if elapsed:
+            elapsed.sort()
+            self.stdout.write(f'{len(profiles)} profiles; request time median {elapsed[len(elapsed) // 2]:.3f}s, '
+                              f'max {elapsed[-1]:.3f}s')
+        if slack_methods:
+            self.stdout.write(f'\n{"Slack method":<40}{"calls":>7}{"wait s":>10}{"request s":>11}{"mean s":>9}')
+            for method, (calls, wait, seconds) in sorted(slack_methods.items(), key=lambda item: -item[1][2]):
+                self.stdout.write(f'{method:<40}{calls:>7}{wait:>10.3f}{seconds:>11.3f}{seconds / calls:>9.3f}')
+        self.stdout.write('')
@@ -0,0 +1,54 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from slack_provisioning import audit
+from slack_provisioning.enrollment_sync import (get_high_water_mark, pending_exports, set_high_water_mark,
+                                                sync_export)
+from slack_provisioning.ratelimit import batch_priority, process_local_cache_warning
+
+
+class Command(BaseCommand):
+    help = ('Applies the enrollment adds, drops and role changes in new Canvas SIS exports to the Slack workspaces '
+            'of their courses. Exports are read from a directory in name order, starting after the last one '
+            'applied.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('export_dir',
+                            help='Directory of SIS exports (directories or .zip files with an enrollments.csv and '
+                                 'users.csv), named so they sort oldest first.')
+        parser.add_argument('--since', help='Apply exports named after this one, instead of the high-water mark.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only report the changes; don't call Slack or move the high-water mark.")
+
+    def handle(self, *args, **options):
+        if not os.path.isdir(options['export_dir']):
+            raise CommandError(f'{options["export_dir"]} is not a directory')
+
+        cache_warning = process_local_cache_warning()
+        if cache_warning:
+            self.stderr.write(self.style.WARNING(cache_warning))
+
+        high_water_mark = options['since'] if options['since'] is not None else get_high_water_mark()
+        exports = pending_exports(options['export_dir'], high_water_mark)
+        self.stdout.write(f'{len(exports)} exports after "{high_water_mark}"')
+
+        for export_path in exports:
+            name = os.path.basename(export_path)
+            started = time.monotonic()
+            # yield the shared Slack budget to launches and joins
+            with batch_priority():
+                result = sync_export(export_path, dry_run=options['dry_run'])
+            audit.flush()
+            self.stdout.write(f'{name}: {result} ({time.monotonic() - started:.0f}s)')
+            if options['dry_run']:
+                continue
+            if result.failed:
+                # later exports may depend on this one; the next run retries the changes that are still missing
+                raise CommandError(f'{result.failed} changes in {name} failed; the high-water mark stays at '
+                                   f'"{high_water_mark}"')
+            set_high_water_mark(name)
+            high_water_mark = name
+
+        self.stdout.write(self.style.SUCCESS(f'Done; high-water mark is "{high_water_mark}"'))
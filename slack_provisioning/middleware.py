@@ -0,0 +1,103 @@
+import cProfile
+import logging
+import random
+import re
+import time
+import uuid
+
+from django.conf import settings
+
+from . import profiling
+from .audit import audit_context
+from .db_router import routing_scope
+from .slack_api import record_call_timings
+from .tenants import get_tenant_for_launch, use_tenant
+
+logger = logging.getLogger(__name__)
+
+# request ids taken from X-Request-Id; they're used in profile file names
+_REQUEST_ID = re.compile(r'[A-Za-z0-9-]{1,64}')
+
+
+class SlackTenantMiddleware:
+    """
+    Routes the Slack API calls made while handling a request to the Enterprise Grid tenant for its LTI launch.
+    Must come after the LTI launch middleware, which sets request.LTI.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        tenant = get_tenant_for_launch(getattr(request, 'LTI', {}))
+        request.slack_tenant = tenant
+        with use_tenant(tenant):
+            return self.get_response(request)
+
+
+class DatabaseRoutingMiddleware:
+    """
+    Gives each request its own read-your-writes scope for ReplicaRouter.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with routing_scope():
+            return self.get_response(request)
+
+
+class AuditContextMiddleware:
+    """
+    Attributes audit events recorded while handling a request to the course and user of its LTI launch.
+    Must come after the LTI launch middleware, which sets request.LTI.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        lti_params = getattr(request, 'LTI', {})
+        with audit_context(course_sis_id=lti_params.get('lis_course_offering_sourcedid'),
+                           univ_id=lti_params.get('lis_person_sourcedid')):
+            return self.get_response(request)
+
+
+class ProfilingMiddleware:
+    """
+    Profiles a sample of requests to slack_provisioning views (settings.SLACK_PROVISIONING['profile_sample_rate'])
+    and any request with a valid X-Slack-Tool-Profile header, see profiling.py.
+    Should be the last middleware, so the profile only covers the view.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = settings.SLACK_PROVISIONING.get('profile_sample_rate', 0)
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not view_func.__module__.startswith('slack_provisioning'):
+            return None
+        sampled = self.sample_rate and random.random() < self.sample_rate
+        if not sampled and not profiling.has_valid_profile_token(request):
+            return None
+
+        request_id = request.META.get('HTTP_X_REQUEST_ID', '')
+        if not _REQUEST_ID.fullmatch(request_id):
+            request_id = uuid.uuid4().hex
+        profiler = cProfile.Profile()
+        with record_call_timings() as slack_calls:
+            started = time.perf_counter()
+            profiler.enable()
+            try:
+                response = view_func(request, *view_args, **view_kwargs)
+            finally:
+                profiler.disable()
+                elapsed = time.perf_counter() - started
+                try:
+                    profiling.save_profile(profiler, request_id, view_func.__name__, request.path, elapsed,
+                                           slack_calls)
+                except OSError:
+                    logger.exception('Could not save request profile')
+
+        response['X-Profile-Id'] = request_id
+        return response
@@ -0,0 +1,33 @@
+# Generated by Django 2.2.13 on 2026-10-19 05:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('slack_provisioning', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='slackworkspace',
+            name='term_name',
+            field=models.CharField(db_index=True, max_length=100, null=True),
+        ),
+        migrations.AlterField(
+            model_name='slackworkspace',
+            name='course_sis_id',
+            field=models.CharField(db_index=True, max_length=30, null=True),
+        ),
+        migrations.AlterField(
+            model_name='slackworkspace',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='slackworkspace',
+            name='status',
+            field=models.CharField(choices=[('pending', 'pending'), ('completed', 'completed'), ('failed', 'failed')], db_index=True, default='pending', max_length=30),
+        ),
+    ]
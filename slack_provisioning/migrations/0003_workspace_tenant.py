@@ -0,0 +1,18 @@
+# Generated by Django 2.2.13 on 2026-10-19 05:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('slack_provisioning', '0002_workspace_term_and_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='slackworkspace',
+            name='tenant',
+            field=models.CharField(db_index=True, default='default', max_length=30),
+        ),
+    ]
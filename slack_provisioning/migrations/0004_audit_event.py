@@ -0,0 +1,47 @@
+# Generated by Django 2.2.13 on 2026-10-19 05:42
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('slack_provisioning', '0003_workspace_tenant'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlackAuditEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('action', models.CharField(choices=[('workspace_created', 'workspace_created'), ('workspace_creation_failed', 'workspace_creation_failed'), ('user_assigned', 'user_assigned'), ('user_assignment_failed', 'user_assignment_failed'), ('admin_set', 'admin_set'), ('admin_set_failed', 'admin_set_failed')], max_length=30)),
+                ('tenant', models.CharField(default='default', max_length=30)),
+                ('course_sis_id', models.CharField(max_length=30, null=True)),
+                ('team_id', models.CharField(max_length=30, null=True)),
+                ('univ_id', models.CharField(max_length=30, null=True)),
+                ('slack_user_id', models.CharField(max_length=20, null=True)),
+                ('detail', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'db_table': 'slack_audit_event',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='slackauditevent',
+            index=models.Index(fields=['course_sis_id', 'created_at'], name='slack_audit_course__6d3d1b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='slackauditevent',
+            index=models.Index(fields=['univ_id', 'created_at'], name='slack_audit_univ_id_df8f91_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='slackauditevent',
+            index=models.Index(fields=['slack_user_id', 'created_at'], name='slack_audit_slack_u_8f1cf4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='slackauditevent',
+            index=models.Index(fields=['created_at'], name='slack_audit_created_9a9d27_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.2.13 on 2026-10-19 05:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('slack_provisioning', '0004_audit_event'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='slackworkspace',
+            name='archived_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='slackauditevent',
+            name='action',
+            field=models.CharField(choices=[('workspace_created', 'workspace_created'), ('workspace_creation_failed', 'workspace_creation_failed'), ('user_assigned', 'user_assigned'), ('user_assignment_failed', 'user_assignment_failed'), ('admin_set', 'admin_set'), ('admin_set_failed', 'admin_set_failed'), ('user_removed', 'user_removed'), ('workspace_archived', 'workspace_archived')], max_length=30),
+        ),
+        migrations.AlterField(
+            model_name='slackworkspace',
+            name='status',
+            field=models.CharField(choices=[('pending', 'pending'), ('completed', 'completed'), ('failed', 'failed'), ('archiving', 'archiving'), ('archived', 'archived')], db_index=True, default='pending', max_length=30),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.2.13 on 2026-10-19 05:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('slack_provisioning', '0005_workspace_archiving'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlackSyncState',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('high_water_mark', models.CharField(blank=True, default='', max_length=255)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'slack_sync_state',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='slackworkspacemember',
+            index=models.Index(fields=['slack_workspace', 'univ_id'], name='slack_works_slack_w_ab13ba_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='slackworkspacemember',
+            index=models.Index(fields=['univ_id'], name='slack_works_univ_id_f11d9a_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.13 on 2026-10-19 05:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('slack_provisioning', '0006_member_indexes_and_sync_state'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='slackworkspace',
+            name='section_channels',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
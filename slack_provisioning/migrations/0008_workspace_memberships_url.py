@@ -0,0 +1,23 @@
+# Generated by Django 2.2.13 on 2026-10-19 05:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('slack_provisioning', '0007_workspace_section_channels'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='slackworkspace',
+            name='lti_consumer_key',
+            field=models.CharField(max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='slackworkspace',
+            name='memberships_url',
+            field=models.CharField(max_length=500, null=True),
+        ),
+    ]
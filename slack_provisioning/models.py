@@ -1,22 +1,44 @@
 from django.db import models
+from django.utils import timezone
+
+
+class SlackWorkspaceQuerySet(models.QuerySet):
+    def active(self):
+        """
+        Excludes workspaces that have been, or are being, archived at the end of their term.
+        """
+        return self.exclude(status__in=['archiving', 'archived'])
 
 
 class SlackWorkspace(models.Model):
     STATUS_CHOICES = [
         ('pending', 'pending'),
         ('completed', 'completed'),
-        ('failed', 'failed')
+        ('failed', 'failed'),
+        ('archiving', 'archiving'),
+        ('archived', 'archived'),
     ]
     team_domain = models.CharField(max_length=21)
     team_name = models.CharField(max_length=100)
     team_description = models.CharField(max_length=100, null=True)
     team_discoverability = models.CharField(max_length=30, null=True)
     team_id = models.CharField(max_length=30, null=True)
-    course_sis_id = models.CharField(max_length=30, null=True)
-    created_at = models.DateTimeField(auto_now_add=True)
+    course_sis_id = models.CharField(max_length=30, null=True, db_index=True)
+    term_name = models.CharField(max_length=100, null=True, db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     created_by = models.CharField(max_length=30)
     last_modified = models.DateTimeField(auto_now_add=True)
-    status = models.CharField(max_length=30, choices=STATUS_CHOICES, default='pending')
+    status = models.CharField(max_length=30, choices=STATUS_CHOICES, default='pending', db_index=True)
+    # name of the Enterprise Grid tenant the workspace was created in, see tenants.py
+    tenant = models.CharField(max_length=30, default='default', db_index=True)
+    archived_at = models.DateTimeField(null=True)
+    # JSON-encoded map of course section SIS id to the id of the section's channel, see sections.py
+    section_channels = models.TextField(blank=True, default='')
+    # the course's LTI membership service and the consumer key to sign requests to it with, see roster.py
+    memberships_url = models.CharField(max_length=500, null=True)
+    lti_consumer_key = models.CharField(max_length=100, null=True)
+
+    objects = SlackWorkspaceQuerySet.as_manager()
 
     class Meta:
         db_table = 'slack_workspace'
@@ -37,3 +59,71 @@ class SlackWorkspaceMember(models.Model):
 
     class Meta:
         db_table = 'slack_workspace_member'
+        indexes = [
+            models.Index(fields=['slack_workspace', 'univ_id']),
+            models.Index(fields=['univ_id']),
+        ]
+
+
+class SlackSyncState(models.Model):
+    """
+    How far a recurring sync job has got, eg: the last enrollment export applied by sync_enrollments.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    high_water_mark = models.CharField(max_length=255, blank=True, default='')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'slack_sync_state'
+
+
+class SlackAuditEventQuerySet(models.QuerySet):
+    def for_course(self, course_sis_id):
+        return self.filter(course_sis_id=course_sis_id)
+
+    def for_user(self, univ_id=None, slack_user_id=None):
+        if univ_id is not None:
+            return self.filter(univ_id=univ_id)
+        return self.filter(slack_user_id=slack_user_id)
+
+    def between(self, start=None, end=None):
+        queryset = self
+        if start is not None:
+            queryset = queryset.filter(created_at__gte=start)
+        if end is not None:
+            queryset = queryset.filter(created_at__lt=end)
+        return queryset
+
+
+class SlackAuditEvent(models.Model):
+    ACTION_CHOICES = [
+        ('workspace_created', 'workspace_created'),
+        ('workspace_creation_failed', 'workspace_creation_failed'),
+        ('user_assigned', 'user_assigned'),
+        ('user_assignment_failed', 'user_assignment_failed'),
+        ('admin_set', 'admin_set'),
+        ('admin_set_failed', 'admin_set_failed'),
+        ('user_removed', 'user_removed'),
+        ('workspace_archived', 'workspace_archived'),
+    ]
+    action = models.CharField(max_length=30, choices=ACTION_CHOICES)
+    tenant = models.CharField(max_length=30, default='default')
+    course_sis_id = models.CharField(max_length=30, null=True)
+    team_id = models.CharField(max_length=30, null=True)
+    univ_id = models.CharField(max_length=30, null=True)
+    slack_user_id = models.CharField(max_length=20, null=True)
+    # JSON-encoded details, eg: the Slack error
+    detail = models.TextField(blank=True, default='')
+    # when the action happened, not when the buffered event was written
+    created_at = models.DateTimeField(default=timezone.now)
+
+    objects = SlackAuditEventQuerySet.as_manager()
+
+    class Meta:
+        db_table = 'slack_audit_event'
+        indexes = [
+            models.Index(fields=['course_sis_id', 'created_at']),
+            models.Index(fields=['univ_id', 'created_at']),
+            models.Index(fields=['slack_user_id', 'created_at']),
+            models.Index(fields=['created_at']),
+        ]
@@ -0,0 +1,81 @@
+"""
+On-demand cProfile profiles of slack_provisioning views, see ProfilingMiddleware.
+
+Each profile is written to the profile directory as a .prof file (readable by pstats) with a .json file beside it
+holding the request id, view name, elapsed time and a breakdown of the Slack calls made. Only the newest
+profile_max_files profiles are kept.
+"""
+import json
+import logging
+import os
+import time
+
+from django.conf import settings
+from django.core import signing
+
+logger = logging.getLogger(__name__)
+
+# requests carrying this header with a valid token are always profiled
+PROFILE_HEADER = 'HTTP_X_SLACK_TOOL_PROFILE'
+PROFILE_TOKEN_SALT = 'slack_provisioning.profile'
+# seconds a profile token stays valid
+PROFILE_TOKEN_MAX_AGE = 24 * 60 * 60
+
+DEFAULT_MAX_FILES = 200
+
+
+def get_profile_dir():
+    return settings.SLACK_PROVISIONING.get('profile_dir', os.path.join(settings.BASE_DIR, 'profiles'))
+
+
+def make_profile_token():
+    """
+    :return: A value for the X-Slack-Tool-Profile header, valid for PROFILE_TOKEN_MAX_AGE seconds.
+    """
+    return signing.TimestampSigner(salt=PROFILE_TOKEN_SALT).sign('profile')
+
+
+def has_valid_profile_token(request):
+    token = request.META.get(PROFILE_HEADER)
+    if not token:
+        return False
+    try:
+        signing.TimestampSigner(salt=PROFILE_TOKEN_SALT).unsign(token, max_age=PROFILE_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        logger.warning('Ignoring a profiling request with an invalid or expired token')
+        return False
+    return True
+
+
+def save_profile(profiler, request_id, view_name, path, elapsed, slack_calls):
+    """
+    Writes a profile and its summary, then deletes the oldest profiles beyond profile_max_files.
+    :param slack_calls: (method, rate limit wait seconds, request seconds) tuples, see slack_api.record_call_timings
+    """
+    profile_dir = get_profile_dir()
+    os.makedirs(profile_dir, exist_ok=True)
+    base_name = os.path.join(profile_dir, f'{time.strftime("%Y%m%dT%H%M%S")}-{view_name}-{request_id}')
+
+    profiler.dump_stats(base_name + '.prof')
+    with open(base_name + '.json', 'w') as summary:
+        json.dump({
+            'request_id': request_id,
+            'view': view_name,
+            'path': path,
+            'elapsed': elapsed,
+            'slack_seconds': sum(wait + seconds for _, wait, seconds in slack_calls),
+            'slack_calls': [{'method': method, 'wait': wait, 'seconds': seconds}
+                            for method, wait, seconds in slack_calls],
+        }, summary)
+
+    _rotate(profile_dir, settings.SLACK_PROVISIONING.get('profile_max_files', DEFAULT_MAX_FILES))
+
+
+def _rotate(profile_dir, max_files):
+    profiles = sorted(name for name in os.listdir(profile_dir) if name.endswith('.prof'))
+    for name in profiles[:-max_files]:
+        for path in (name, name[:-len('.prof')] + '.json'):
+            try:
+                os.remove(os.path.join(profile_dir, path))
+            except FileNotFoundError:
+                pass
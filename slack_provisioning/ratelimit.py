@@ -0,0 +1,270 @@
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# Requests per minute allowed by each Slack rate limit tier, see https://api.slack.com/docs/rate-limits
+# Slack doesn't publish a tier for the SCIM API, so SCIM calls get their own conservative budget.
+RATE_LIMIT_TIERS = {
+    1: 1,
+    2: 20,
+    3: 50,
+    4: 100,
+    'scim': 180,
+}
+
+# The rate limit tier of each Slack method called from slack_api. Limits are applied per method.
+METHOD_TIERS = {
+    'admin.teams.create': 1,
+    'admin.users.invite': 2,
+    'admin.users.setAdmin': 2,
+    'admin.users.list': 3,
+    'users.info': 4,
+    'admin.teams.admins.list': 3,
+    'admin.teams.settings.info': 3,
+    'admin.teams.settings.setIcon': 2,
+    'admin.users.assign': 2,
+    'admin.users.remove': 2,
+    'admin.teams.settings.setName': 2,
+    'admin.teams.settings.setDiscoverability': 2,
+    'admin.conversations.create': 2,
+    'scim.Users.get': 'scim',
+    'scim.Users.create': 'scim',
+}
+
+# tier used for methods missing from METHOD_TIERS
+DEFAULT_TIER = 2
+
+# seconds of budget a method may use in a burst above its steady rate
+BURST_SECONDS = 10
+
+INTERACTIVE = 'interactive'
+BATCH = 'batch'
+
+# fraction of each method's budget batch work leaves untouched, so a spike of launches finds budget waiting for it
+BATCH_RESERVE = 0.5
+
+# granularity, in seconds, of the per-method call counts shared between processes
+USAGE_SLOT_SECONDS = 10
+
+# cache backends that only the process that wrote an entry can read
+PROCESS_LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+_priority = contextvars.ContextVar('slack_call_priority', default=INTERACTIVE)
+
+
+def current_priority():
+    return _priority.get()
+
+
+def process_local_cache_warning():
+    """
+    :return: A warning for batch commands if the default cache isn't shared between processes, or None. The batch
+    process then can't see the web processes' Slack calls, nor they its calls, so it never yields to launches.
+    """
+    backend = settings.CACHES.get('default', {}).get('BACKEND')
+    if backend not in PROCESS_LOCAL_CACHE_BACKENDS:
+        return None
+    return (f'The default cache ({backend}) is local to this process, so this job can\'t see the Slack calls made '
+            f'by launches and joins and won\'t leave them any rate limit budget. Configure a shared cache (eg: '
+            f'memcached or Redis) in CACHES before running it alongside the web workers.')
+
+
+@contextmanager
+def batch_priority():
+    """
+    Marks Slack calls made inside the block as background work: they only use budget that interactive requests
+    leave over, and wait while interactive requests are waiting.
+    """
+    token = _priority.set(BATCH)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket refilled at `per_minute` tokens per minute, shared by interactive and batch callers.
+    Interactive callers take any available token. Batch callers only take a token when no interactive caller is
+    waiting and the bucket would still hold its batch reserve afterwards.
+    """
+    def __init__(self, per_minute, burst_seconds=BURST_SECONDS, batch_reserve=BATCH_RESERVE):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.batch_reserve = min(self.capacity * batch_reserve, self.capacity - 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.interactive_waiting = 0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, priority=INTERACTIVE):
+        """
+        Takes a token if one is available to the given priority.
+        :return: 0 if a token was taken, otherwise the number of seconds to wait before trying again.
+        """
+        with self.lock:
+            self._refill(time.monotonic())
+            needed = 1
+            if priority == BATCH:
+                if self.interactive_waiting:
+                    return 1 / self.rate
+                needed += self.batch_reserve
+            if self.tokens >= needed:
+                self.tokens -= 1
+                return 0
+            return (needed - self.tokens) / self.rate
+
+    def acquire(self, timeout, priority=INTERACTIVE):
+        """
+        Takes a token, waiting up to `timeout` seconds for one.
+        :return: True if a token was taken, False if none became available in time.
+        """
+        deadline = time.monotonic() + timeout
+        if priority == INTERACTIVE:
+            with self.lock:
+                self.interactive_waiting += 1
+        try:
+            while True:
+                wait = self.try_acquire(priority)
+                if not wait:
+                    return True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                time.sleep(min(wait, remaining))
+        finally:
+            if priority == INTERACTIVE:
+                with self.lock:
+                    self.interactive_waiting -= 1
+
+
+class _WaitStats:
+    __slots__ = ('calls', 'waits', 'wait_seconds', 'max_wait_seconds', 'rejected')
+
+    def __init__(self):
+        self.calls = self.waits = self.rejected = 0
+        self.wait_seconds = self.max_wait_seconds = 0.0
+
+    def as_dict(self):
+        return {
+            'calls': self.calls,
+            'waits': self.waits,
+            'mean_wait_seconds': round(self.wait_seconds / self.waits, 3) if self.waits else 0.0,
+            'max_wait_seconds': round(self.max_wait_seconds, 3),
+            'rejected': self.rejected,
+        }
+
+
+class RateLimiter:
+    """
+    One token bucket per Slack method, sized from the method's rate limit tier, plus a count of recent calls per
+    method kept in the shared Django cache.
+    Buckets live in process memory, so `share` should be the fraction of each Slack budget this process may use.
+    The shared counts let batch jobs running in other processes see interactive traffic: batch calls only go ahead
+    while calls from all processes over the last minute leave the batch reserve of the method's budget unused.
+    """
+    def __init__(self, tiers=None, share=1.0, key_prefix='slack:ratelimit'):
+        self.tiers = dict(RATE_LIMIT_TIERS)
+        self.tiers.update(tiers or {})
+        self.share = share
+        self.key_prefix = key_prefix
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._stats = {INTERACTIVE: _WaitStats(), BATCH: _WaitStats()}
+
+    def per_minute(self, method):
+        return self.tiers[METHOD_TIERS.get(method, DEFAULT_TIER)]
+
+    def bucket(self, method):
+        with self._lock:
+            bucket = self._buckets.get(method)
+            if bucket is None:
+                bucket = self._buckets[method] = TokenBucket(self.per_minute(method) * self.share)
+            return bucket
+
+    def _usage_keys(self, method, now):
+        slot = int(now // USAGE_SLOT_SECONDS)
+        return [f'{self.key_prefix}:{method}:{slot - offset}' for offset in range(60 // USAGE_SLOT_SECONDS)]
+
+    def _record_usage(self, method):
+        key = self._usage_keys(method, time.time())[0]
+        cache.add(key, 0, timeout=120)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # expired between add and incr
+            cache.set(key, 1, timeout=120)
+
+    def _recent_usage(self, method):
+        return sum(cache.get_many(self._usage_keys(method, time.time())).values())
+
+    def _acquire_interactive(self, method, timeout):
+        bucket = self.bucket(method)
+        acquired = not bucket.try_acquire(INTERACTIVE) or bucket.acquire(timeout, INTERACTIVE)
+        if acquired:
+            self._record_usage(method)
+        return acquired
+
+    def _acquire_batch(self, method, timeout):
+        bucket = self.bucket(method)
+        # this process's share of the calls all processes may make per minute; at least one, or a tier 1 method
+        # would never leave room for a batch call
+        allowance = max(1.0, self.per_minute(method) * self.share * (1 - BATCH_RESERVE))
+        poll = max(60 / self.per_minute(method), 0.5)
+        deadline = time.monotonic() + timeout
+        while True:
+            if self._recent_usage(method) + 1 <= allowance and not bucket.try_acquire(BATCH):
+                self._record_usage(method)
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(poll, remaining))
+
+    def acquire(self, method, timeout, priority=None):
+        """
+        Waits up to `timeout` seconds for budget to call the given Slack method.
+        :param priority: INTERACTIVE or BATCH; defaults to the priority of the current context.
+        :return: True if the call may go ahead.
+        """
+        priority = priority or current_priority()
+        started = time.monotonic()
+        if priority == BATCH:
+            acquired = self._acquire_batch(method, timeout)
+        else:
+            acquired = self._acquire_interactive(method, timeout)
+        waited = time.monotonic() - started
+
+        with self._lock:
+            stats = self._stats[priority]
+            stats.calls += 1
+            if waited >= 0.001:
+                stats.waits += 1
+                stats.wait_seconds += waited
+                stats.max_wait_seconds = max(stats.max_wait_seconds, waited)
+            if not acquired:
+                stats.rejected += 1
+        if not acquired:
+            logger.warning(f'No rate limit budget for {priority} call to {method} after waiting {waited:.1f}s')
+        return acquired
+
+    def stats(self):
+        """
+        :return: Calls, queue waits and rejections for interactive and batch calls in this process.
+        """
+        with self._lock:
+            return {priority: stats.as_dict() for priority, stats in self._stats.items()}
@@ -0,0 +1,255 @@
+"""
+Course rosters from the LTI 1.1 membership service.
+
+The launch carries the course's membership service URL ($ToolProxyBinding.memberships.url) in
+custom_context_memberships_url, and the tool keeps it on the course's workspace so batch jobs can read the roster
+without a launch or a CSV export. The service returns LIS v2 membership containers, whose memberships are in
+pageOf.membershipSubject.membership and whose next page is named by nextPage. MembershipClient.iter_members()
+streams the roster page by page and yields a RosterMember for each active member whose roles the tool admits
+(util.ALLOWED_ADMIN_ROLES and ALLOWED_MEMBER_ROLES). Pages in the LTI Advantage NRPS format (a members list, with
+the next page in a Link: rel="next" header) are read too, for a session that authenticates that way.
+
+A complete roster is cached per membership URL along with its ETag and Last-Modified headers. The next read
+makes a conditional request and, on a 304, serves the cached roster without fetching any pages.
+
+Requests are signed with OAuth 1.0a using the launch's consumer key and its secret from LTI_OAUTH_CREDENTIALS.
+Pass a session to use anything else, eg: a requests Session that adds an LTI 1.3 bearer token, or a stub.
+"""
+import hashlib
+import logging
+import re
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import util
+
+logger = logging.getLogger(__name__)
+
+MEMBERSHIPS_LTI_PARAM = 'custom_context_memberships_url'
+LIS_MEDIA_TYPE = 'application/vnd.ims.lis.v2.membershipcontainer+json'
+NRPS_MEDIA_TYPE = 'application/vnd.ims.lti-nrps.v2.membershipcontainer+json'
+
+# members requested per page
+DEFAULT_PAGE_SIZE = 100
+# seconds to wait for each page
+REQUEST_TIMEOUT = 30
+# seconds a complete roster is cached; it's revalidated with a conditional request before each use
+DEFAULT_ROSTER_CACHE_TIMEOUT = 24 * 60 * 60
+
+ROSTER_KEY_PREFIX = 'slack:roster'
+
+# LIS and NRPS roles, by their last segment, as the roles util.ALLOWED_ADMIN_ROLES and ALLOWED_MEMBER_ROLES list
+ROLES = {
+    'Instructor': 'Instructor',
+    'TeachingAssistant': 'TA',
+    'ContentDeveloper': 'Designer',
+    'Learner': 'Learner',
+}
+INSTITUTION_ADMINISTRATOR_ROLE = 'urn:lti:instrole:ims/lis/Administrator'
+
+_LINK_NEXT = re.compile(r'<([^>]+)>\s*;\s*rel="?next"?')
+
+
+class RosterMember:
+    __slots__ = ('user_id', 'univ_id', 'email', 'name', 'roles', 'is_staff')
+
+    def __init__(self, user_id, univ_id, email, name, roles, is_staff):
+        self.user_id = user_id
+        self.univ_id = univ_id
+        self.email = email
+        self.name = name
+        self.roles = roles
+        self.is_staff = is_staff
+
+    def __reduce__(self):
+        return self.__class__, tuple(getattr(self, name) for name in self.__slots__)
+
+    def __repr__(self):
+        return f'<RosterMember {self.univ_id} {self.roles}>'
+
+
+def normalize_roles(roles):
+    """
+    :param roles: LIS roles, eg: "urn:lti:role:ims/lis/TeachingAssistant" or "Instructor", or NRPS role URIs, eg:
+    "http://purl.imsglobal.org/vocab/lis/v2/membership/Instructor#TeachingAssistant"
+    :return: The roles as the launch reports them, eg: ['TA']
+    """
+    normalized = []
+    for role in roles:
+        if role == INSTITUTION_ADMINISTRATOR_ROLE or ('institution' in role and role.endswith('#Administrator')):
+            normalized.append(INSTITUTION_ADMINISTRATOR_ROLE)
+            continue
+        name = re.split(r'[#/:]', role)[-1]
+        normalized.append(ROLES.get(name, role))
+    return normalized
+
+
+def _roster_member(user_id, univ_id, email, name, roles, status):
+    """
+    :return: A RosterMember, or None if the member is inactive or has no role the tool admits.
+    """
+    if (status or 'Active') != 'Active':
+        return None
+    roles = normalize_roles(roles)
+    if not util.is_user_in_class(user_roles=roles):
+        return None
+    return RosterMember(user_id=user_id, univ_id=univ_id, email=email, name=name, roles=tuple(roles),
+                        is_staff=util.is_user_staff(user_roles=roles))
+
+
+def _parse_page(response):
+    """
+    :return: The RosterMembers the tool admits on a page of either format, and the URL of the next page or None.
+    :raises RosterError: if the page isn't a membership container.
+    """
+    try:
+        body = response.json()
+    except ValueError:
+        raise RosterError(f'Membership service returned a non-JSON page: {response.text[:200]}')
+    if not isinstance(body, dict):
+        raise RosterError(f'Unrecognized membership page: {response.text[:200]}')
+
+    if 'pageOf' in body:
+        try:
+            memberships = body['pageOf']['membershipSubject']['membership']
+        except (KeyError, TypeError):
+            raise RosterError(f'Unrecognized membership container: {response.text[:200]}')
+        members = []
+        for membership in memberships or []:
+            member = membership.get('member') or {}
+            roles = membership.get('role') or []
+            members.append(_roster_member(
+                user_id=member.get('user_id'),
+                univ_id=member.get('sourcedId'),
+                email=member.get('email'),
+                name=member.get('name'),
+                roles=[roles] if isinstance(roles, str) else roles,
+                status=membership.get('status'),
+            ))
+        next_url = body.get('nextPage')
+    elif 'members' in body:
+        members = [_roster_member(
+            user_id=member.get('user_id'),
+            univ_id=member.get('lis_person_sourcedid'),
+            email=member.get('email'),
+            name=member.get('name'),
+            roles=member.get('roles', []),
+            status=member.get('status'),
+        ) for member in body['members'] or []]
+        match = _LINK_NEXT.search(response.headers.get('Link', ''))
+        next_url = match.group(1) if match else None
+    else:
+        raise RosterError(f'Unrecognized membership page: {response.text[:200]}')
+    return [member for member in members if member is not None], next_url
+
+
+def _oauth_session(consumer_key):
+    # requests_oauthlib comes with the lti package; imported here to keep worker startup cheap
+    import requests
+    from requests_oauthlib import OAuth1
+
+    session = requests.Session()
+    session.auth = OAuth1(consumer_key, settings.LTI_OAUTH_CREDENTIALS[consumer_key])
+    return session
+
+
+class RosterError(Exception):
+    pass
+
+
+class MembershipClient:
+    def __init__(self, memberships_url, consumer_key=None, session=None, page_size=DEFAULT_PAGE_SIZE):
+        """
+        :param session: Anything with a requests-style get(); defaults to a Session signing requests with the
+        consumer key's OAuth secret.
+        """
+        if session is None and consumer_key is None:
+            raise ValueError('MembershipClient needs a consumer_key or a session')
+        self.memberships_url = memberships_url
+        self.consumer_key = consumer_key
+        self.page_size = page_size
+        self._session = session
+
+    @property
+    def session(self):
+        if self._session is None:
+            self._session = _oauth_session(self.consumer_key)
+        return self._session
+
+    @property
+    def cache_key(self):
+        return f'{ROSTER_KEY_PREFIX}:{hashlib.md5(self.memberships_url.encode()).hexdigest()}'
+
+    def _get(self, url, params=None, cached=None):
+        headers = {'Accept': f'{LIS_MEDIA_TYPE}, {NRPS_MEDIA_TYPE};q=0.9'}
+        if cached:
+            if cached.get('etag'):
+                headers['If-None-Match'] = cached['etag']
+            if cached.get('last_modified'):
+                headers['If-Modified-Since'] = cached['last_modified']
+        response = self.session.get(url, headers=headers, params=params, timeout=REQUEST_TIMEOUT)
+        if response.status_code not in (200, 304):
+            raise RosterError(f'Membership service error {response.status_code} for {url}: {response.text[:200]}')
+        return response
+
+    def iter_members(self, use_cache=True):
+        """
+        Yields the roster's members one page at a time. Once the last page has been read, the roster is cached.
+        :param use_cache: Revalidate and use the cached roster, if there is one.
+        :raises RosterError: if the membership service returns an error or a page that isn't a membership container.
+        """
+        cached = cache.get(self.cache_key) if use_cache else None
+        response = self._get(self.memberships_url, params={'limit': self.page_size}, cached=cached)
+        if response.status_code == 304 and cached:
+            logger.debug(f'Roster at {self.memberships_url} is unchanged; using the cached copy')
+            yield from cached['members']
+            return
+
+        etag, last_modified = response.headers.get('ETag'), response.headers.get('Last-Modified')
+        members = []
+        pages = 0
+        while True:
+            pages += 1
+            page_members, next_url = _parse_page(response)
+            members += page_members
+            yield from page_members
+            if not next_url:
+                break
+            response = self._get(next_url)
+
+        logger.info(f'Read {len(members)} members in {pages} pages from {self.memberships_url}')
+        if etag or last_modified:
+            cache.set(self.cache_key, {'etag': etag, 'last_modified': last_modified, 'members': members},
+                      settings.SLACK_PROVISIONING.get('roster_cache_timeout', DEFAULT_ROSTER_CACHE_TIMEOUT))
+
+
+def get_memberships_url(lti_params):
+    """
+    :return: The launch's membership service URL, or None if the platform didn't send one.
+    """
+    value = lti_params.get(MEMBERSHIPS_LTI_PARAM) or ''
+    # the unexpanded variable is sent when the platform doesn't offer the service
+    if not value or value.startswith('$'):
+        return None
+    return value
+
+
+def client_for_launch(lti_params, session=None):
+    """
+    :return: A MembershipClient for the launch's course, or None if the launch has no membership URL.
+    """
+    memberships_url = get_memberships_url(lti_params)
+    if memberships_url is None:
+        return None
+    return MembershipClient(memberships_url, consumer_key=lti_params.get('oauth_consumer_key'), session=session)
+
+
+def client_for_workspace(slack_workspace, session=None):
+    """
+    :return: A MembershipClient for the workspace's course, from the membership URL of its last launch, or None.
+    """
+    if not slack_workspace.memberships_url:
+        return None
+    return MembershipClient(slack_workspace.memberships_url, consumer_key=slack_workspace.lti_consumer_key,
+                            session=session)
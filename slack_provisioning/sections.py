@@ -0,0 +1,101 @@
+"""
+A channel per course section in each workspace.
+
+Canvas sends the SIS ids of the launching user's sections in custom_canvas_course_sectionsissourceids. Channels
+are created for the provisioning staff member's sections when the workspace is provisioned, and for any section
+seen for the first time when a user joins. The section -> channel id map is kept on the workspace, so joining
+users are assigned to their section channels in the same admin.users.assign call as the default channels.
+"""
+import json
+import logging
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from . import util
+from .models import SlackWorkspace
+from .slack_api import SlackTooManyRequests, create_channel
+from .workspace_cache import invalidate_workspace
+
+logger = logging.getLogger(__name__)
+
+SECTIONS_LTI_PARAM = 'custom_canvas_course_sectionsissourceids'
+
+
+def get_section_sis_ids(lti_params):
+    """
+    :return: The SIS ids of the launching user's sections, eg: ['20201234567S01']
+    """
+    value = lti_params.get(SECTIONS_LTI_PARAM) or ''
+    # Canvas sends the unexpanded variable when none of the user's sections has an SIS id
+    if value.startswith('$'):
+        return []
+    return [section_sis_id.strip() for section_sis_id in value.split(',') if section_sis_id.strip()]
+
+
+def get_section_channels(slack_workspace):
+    return json.loads(slack_workspace.section_channels) if slack_workspace.section_channels else {}
+
+
+def _save_section_channels(slack_workspace, created):
+    """
+    Adds newly created channels to the workspace's map, merged with those any other request saved meanwhile.
+    """
+    with transaction.atomic():
+        current = SlackWorkspace.objects.select_for_update().only('section_channels').get(pk=slack_workspace.pk)
+        section_channels = get_section_channels(current)
+        section_channels.update(created)
+        slack_workspace.section_channels = json.dumps(section_channels, sort_keys=True)
+        SlackWorkspace.objects.filter(pk=slack_workspace.pk).update(section_channels=slack_workspace.section_channels)
+    invalidate_workspace(slack_workspace.course_sis_id)
+    return section_channels
+
+
+def ensure_section_channels(slack_workspace, section_sis_ids):
+    """
+    Creates channels for any of the given sections that don't have one yet. Channels are created one after
+    another under the Slack rate limit; sections left over when the budget runs out get their channel on a later
+    join.
+    :return: The channel ids of the given sections that have a channel.
+    """
+    section_channels = get_section_channels(slack_workspace)
+    created = {}
+    name_taken = False
+    for section_sis_id in section_sis_ids:
+        if section_sis_id in section_channels:
+            continue
+        name = util.get_section_channel_name(section_sis_id)
+        try:
+            response_data = create_channel(slack_workspace.team_id, name, description=f'Section {section_sis_id}')
+        except SlackTooManyRequests:
+            logger.warning(f'Out of rate limit budget creating section channels in {slack_workspace.team_id}; '
+                           f'the rest will be created on later joins')
+            break
+        if response_data.get('ok'):
+            created[section_sis_id] = response_data['channel_id']
+        elif response_data.get('error') == 'name_taken':
+            # another request created it first; its id is in the workspace row once that request saves it
+            logger.info(f'Channel {name} already exists in {slack_workspace.team_id}')
+            name_taken = True
+        else:
+            logger.error(f'Could not create channel {name} in {slack_workspace.team_id}: {response_data}')
+
+    if created:
+        section_channels = _save_section_channels(slack_workspace, created)
+    elif name_taken:
+        # read from the primary; the replica may not have the other request's update yet
+        slack_workspace.refresh_from_db(using=DEFAULT_DB_ALIAS, fields=['section_channels'])
+        section_channels = get_section_channels(slack_workspace)
+    return [section_channels[section_sis_id] for section_sis_id in section_sis_ids
+            if section_sis_id in section_channels]
+
+
+def get_channel_ids(slack_workspace, default_channels, lti_params):
+    """
+    :param default_channels: The workspace's default channel ids, comma separated.
+    :return: The default channels plus the channels of the launching user's sections, comma separated, for
+    admin.users.assign.
+    """
+    section_channel_ids = ensure_section_channels(slack_workspace, get_section_sis_ids(lti_params))
+    channel_ids = [channel_id for channel_id in default_channels.split(',') if channel_id]
+    channel_ids += [channel_id for channel_id in section_channel_ids if channel_id not in channel_ids]
+    return ','.join(channel_ids)
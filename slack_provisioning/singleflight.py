@@ -0,0 +1,80 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlightTimeout(Exception):
+    pass
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls that share a key into one: the first caller runs the function and every caller
+    that arrives while it's in flight waits for, and shares, its result or exception.
+    Nothing is cached once the call completes.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.calls = 0
+        self.coalesced = 0
+        self.timeouts = 0
+        self.errors = 0
+
+    def do(self, key, fn, timeout=None):
+        """
+        :param key: A hashable key identifying identical calls.
+        :param fn: The function to call if no identical call is in flight.
+        :param timeout: Seconds a coalesced caller waits for the in-flight call before giving up.
+        :return: The result of fn; exceptions raised by fn are raised in every caller.
+        """
+        with self._lock:
+            self.calls += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+
+        if leader:
+            try:
+                call.result = fn()
+            except Exception as e:
+                call.error = e
+                with self._lock:
+                    self.errors += 1
+                raise
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+            return call.result
+
+        if not call.done.wait(timeout):
+            with self._lock:
+                self.timeouts += 1
+            raise SingleFlightTimeout(f'Timed out after {timeout}s waiting for in-flight call {key}')
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def stats(self):
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'coalesced': self.coalesced,
+                'timeouts': self.timeouts,
+                'errors': self.errors,
+                'in_flight': len(self._calls),
+            }
@@ -1,18 +1,132 @@
+import contextvars
 import logging
 import random
+import time
+from contextlib import contextmanager
 
-import requests
 from django.conf import settings
+from django.core.cache import cache
 
+from . import audit
+from .ratelimit import BATCH, INTERACTIVE, current_priority
+from .singleflight import SingleFlightTimeout
+from .slack_types import ScimUser, TeamSettings, WorkspaceUser
+from .tenants import all_tenants, get_current_tenant
 
 logger = logging.getLogger(__name__)
 
 SLACK_ENDPOINT = 'https://slack.com/api/'
 SLACK_SCIM_ENDPOINT = 'https://api.slack.com/scim/v1/'
-SLACK_TOKEN = settings.SLACK_PROVISIONING['slack_api_token']
+
+# set by record_call_timings() while a request is being profiled
+_call_timings = contextvars.ContextVar('slack_call_timings', default=None)
 
 # Visit https://api.slack.com/methods for additional information on the Slack API.
 
+# Seconds a call waits for rate limit budget before giving up with SlackTooManyRequests, by priority.
+# Background jobs (see ratelimit.batch_priority) only get budget that interactive requests leave over.
+RATE_LIMIT_MAX_WAIT = {
+    INTERACTIVE: 10,
+    BATCH: 600,
+}
+
+# Seconds to wait for a connection to Slack and for each read from it; a hung call would otherwise hold its
+# admission slot and pooled connection, and keep the followers of a coalesced read waiting, indefinitely
+DEFAULT_CONNECT_TIMEOUT = 3.05
+DEFAULT_READ_TIMEOUT = 10
+
+# Seconds a team's admin ids are cached; set_workspace_admin and remove_user_from_workspace update the cached set
+DEFAULT_ADMIN_CACHE_TIMEOUT = 300
+
+# Seconds a read waits for an identical in-flight read before giving up, by method
+COALESCED_READ_TIMEOUTS = {
+    'scim.Users.get': 10,
+    'users.info': 10,
+    'admin.teams.admins.list': 10,
+    'admin.teams.settings.info': 10,
+}
+
+
+def _slack_token():
+    return get_current_tenant().slack_api_token
+
+
+def _call(method, http_method, url, **kwargs):
+    """
+    Makes a Slack API request with the current tenant's connection pool, once its rate limit budget allows.
+    :param method: The Slack method name, used to find the rate limit tier.
+    :return: The requests Response object.
+    :raises SlackApiTimeout: if Slack can't be reached or doesn't answer within the slack_connect_timeout and
+    slack_read_timeout settings.
+    """
+    # requests is already loaded by the tenant's session
+    import requests
+
+    config = settings.SLACK_PROVISIONING
+    kwargs.setdefault('timeout', (config.get('slack_connect_timeout', DEFAULT_CONNECT_TIMEOUT),
+                                  config.get('slack_read_timeout', DEFAULT_READ_TIMEOUT)))
+    tenant = get_current_tenant()
+    priority = current_priority()
+    started = time.perf_counter()
+    if not tenant.rate_limiter.acquire(method, RATE_LIMIT_MAX_WAIT[priority], priority):
+        raise SlackTooManyRequests(f'No rate limit budget left for {priority} call to {method} '
+                                   f'on tenant {tenant.name}')
+    admitted = time.perf_counter()
+    try:
+        return tenant.session.request(http_method, url, **kwargs)
+    except (requests.Timeout, requests.ConnectionError) as e:
+        raise SlackApiTimeout(f'{method} on tenant {tenant.name} failed: {e}') from e
+    finally:
+        timings = _call_timings.get()
+        if timings is not None:
+            timings.append((method, admitted - started, time.perf_counter() - admitted))
+
+
+@contextmanager
+def record_call_timings():
+    """
+    Collects a (method, seconds waiting for rate limit budget, seconds in the HTTP request) tuple for every Slack
+    call made inside the block.
+    """
+    timings = []
+    token = _call_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _call_timings.reset(token)
+
+
+def _coalesced_get(method, url, headers, params):
+    """
+    Issues a GET request, sharing the response with any identical request already in flight for the current
+    tenant in this process.
+    :param method: The Slack method name, used as part of the coalescing key and to look up the timeout.
+    :return: The requests Response object.
+    """
+    key = (method, tuple(sorted(params.items())))
+    try:
+        return get_current_tenant().read_flights.do(
+            key,
+            lambda: _call(method, 'GET', url, headers=headers, params=params),
+            timeout=COALESCED_READ_TIMEOUTS.get(method, 10),
+        )
+    except SingleFlightTimeout as e:
+        raise SlackApiTimeout(str(e)) from e
+
+
+def rate_limit_stats():
+    """
+    :return: Calls, rate limit queue waits and rejections by tenant and priority (interactive or batch).
+    """
+    return {name: tenant.rate_limiter.stats() for name, tenant in all_tenants().items()}
+
+
+def coalesced_read_stats():
+    """
+    :return: Counters of read calls made, calls coalesced into an in-flight call, timeouts and errors, by tenant.
+    """
+    return {name: tenant.read_flights.stats() for name, tenant in all_tenants().items()}
+
 
 def create_slack_workspace(team_domain, team_name, team_discoverability='unlisted', description=None):
     """
@@ -25,15 +139,14 @@ def create_slack_workspace(team_domain, team_name, team_discoverability='unliste
     :return: Returns the status ("ok":True/False) and if success will return the team ID of the new workspace.
     """
     params = {
-        'token': SLACK_TOKEN,
+        'token': _slack_token(),
         'team_domain': team_domain,
         'team_name': team_name,
         'team_description': description,
         'team_discoverability': team_discoverability
     }
 
-    req = requests.post(url=SLACK_ENDPOINT+'admin.teams.create',
-                        data=params)
+    req = _call('admin.teams.create', 'POST', SLACK_ENDPOINT+'admin.teams.create', data=params)
 
     logger.info(f'Response data from creating a workspace, '
                 f'domain:{team_domain}, team_name:{team_name}, response data {req.json()}')
@@ -51,14 +164,13 @@ def invite_user_to_workspace(channel_ids, email, team_id):
     :return: Returns the status of the API call ("ok":True/False)
     """
     params = {
-        'token': SLACK_TOKEN,
+        'token': _slack_token(),
         'channel_ids': channel_ids,
         'email': email,
         'team_id': team_id
     }
 
-    req = requests.post(url=SLACK_ENDPOINT+'admin.users.invite',
-                        data=params)
+    req = _call('admin.users.invite', 'POST', SLACK_ENDPOINT+'admin.users.invite', data=params)
 
     logger.info(f'Response data from inviting a user to workspace, '
                 f'team id:{team_id}, email:{email}, response data {req.json()}')
@@ -75,60 +187,111 @@ def set_workspace_admin(team_id, user_id):
     :return:
     """
     params = {
-        'token': SLACK_TOKEN,
+        'token': _slack_token(),
         'team_id': team_id,
         'user_id': user_id
     }
 
-    req = requests.post(url=SLACK_ENDPOINT+'admin.users.setAdmin',
-                        data=params)
+    req = _call('admin.users.setAdmin', 'POST', SLACK_ENDPOINT+'admin.users.setAdmin', data=params)
+    response_data = req.json()
 
     logger.info(f'Response data from setting workspace admin, '
-                f'team id:{team_id}, user_id:{user_id}, response data {req.json()}')
+                f'team id:{team_id}, user_id:{user_id}, response data {response_data}')
 
-    return req.json()
+    if response_data.get('ok'):
+        _update_cached_admin_ids(team_id, add=user_id)
+        audit.record('admin_set', team_id=team_id, slack_user_id=user_id)
+    else:
+        audit.record('admin_set_failed', team_id=team_id, slack_user_id=user_id, detail=response_data)
+
+    return response_data
 
 
-def list_workspace_users(team_id):
+def list_workspace_users(team_id, cursor=None, limit=100):
     """
-    List all users of a given Slack workspace team id.
-    Re pagination, the default limit is 100 per page
+    List one page of users of a given Slack workspace team id.
     Tier 3 (50+ per minute)
     :param team_id: The Slack workspace team ID to retrieve user data from.
-    :return: A list of Slack workspace users from the given team_id.
+    :param cursor: The next_cursor from the previous page's response_metadata, if any.
+    :param limit: The number of users per page, up to 1000.
+    :return: A list of Slack workspace users from the given team_id, with a response_metadata.next_cursor if there
+    are more pages.
     """
     params = {
-        'token': SLACK_TOKEN,
-        'team_id': team_id
+        'token': _slack_token(),
+        'team_id': team_id,
+        'limit': limit,
     }
-    # will need to deal with pagination
-    req = requests.post(url=SLACK_ENDPOINT+'admin.users.list',
-                        data=params)
+    if cursor:
+        params['cursor'] = cursor
+    req = _call('admin.users.list', 'POST', SLACK_ENDPOINT+'admin.users.list', data=params)
+    response_data = req.json()
 
     logger.info(f'Response data from listing workspace users, '
-                f'team id:{team_id}, response data {req.json()}')
+                f'team id:{team_id}, ok:{response_data.get("ok")}, users:{len(response_data.get("users", []))}')
 
-    return req.json()
+    return response_data
+
+
+def iter_workspace_users(team_id, page_size=100):
+    """
+    Yields every user of the given workspace as a WorkspaceUser, fetching one page at a time.
+    :raises SlackApiError: if Slack returns an error for any page.
+    """
+    cursor = None
+    while True:
+        response_data = list_workspace_users(team_id, cursor=cursor, limit=page_size)
+        if not response_data.get('ok'):
+            raise SlackApiError(f'Error listing users of {team_id}: {response_data}')
+        yield from (WorkspaceUser.from_api(user) for user in response_data.get('users', []))
+        cursor = response_data.get('response_metadata', {}).get('next_cursor')
+        if not cursor:
+            return
+
+
+def remove_user_from_workspace(team_id, user_id):
+    """
+    Removes a user from a workspace. Their Grid account and their membership in other workspaces are unaffected.
+    Tier 2 (20+ per minute)
+    :return: Returns the status of the API call ("ok":True/False)
+    """
+    params = {
+        'team_id': team_id,
+        'user_id': user_id,
+    }
+    headers = {
+        'Authorization': f'Bearer {_slack_token()}',
+    }
+    req = _call('admin.users.remove', 'POST', SLACK_ENDPOINT+'admin.users.remove', headers=headers, data=params)
+    response_data = req.json()
+
+    logger.info(f'Response data from removing workspace user, '
+                f'team id:{team_id}, user_id:{user_id}, response data {response_data}')
+
+    if response_data.get('ok'):
+        _update_cached_admin_ids(team_id, discard=user_id)
+        audit.record('user_removed', team_id=team_id, slack_user_id=user_id)
+    return response_data
 
 
 def get_scim_user_by_email(email):
     """
     Retrieves a single user resource by email
     :param email: The email to use when retrieving a Slack user
-    :return: Slack user information
+    :return: A ScimUser, or None if there's no Slack user with the given email
     """
     params = {
         'filter': f'email eq {email}',
     }
     headers = {
-        'Authorization': f'Bearer {SLACK_TOKEN}',
+        'Authorization': f'Bearer {_slack_token()}',
     }
-    req = requests.get(url=SLACK_SCIM_ENDPOINT+'Users', headers=headers, params=params)
+    req = _coalesced_get('scim.Users.get', SLACK_SCIM_ENDPOINT+'Users', headers, params)
     if req.status_code == 200:
         response_data = req.json()
         try:
             if response_data['totalResults'] == 1:
-                return response_data['Resources'][0]
+                return ScimUser.from_api(response_data['Resources'][0])
             elif response_data['totalResults'] == 0:
                 logger.warning(f'No Slack user found matching {email}')
                 return None
@@ -152,10 +315,10 @@ def is_user_in_workspace(user_id, team_id):
         'user': user_id
     }
     headers = {
-        'Authorization': f'Bearer {SLACK_TOKEN}',
+        'Authorization': f'Bearer {_slack_token()}',
     }
     # get the user and check their teams array
-    req = requests.get(url=SLACK_ENDPOINT+'users.info', headers=headers, params=params)
+    req = _coalesced_get('users.info', SLACK_ENDPOINT+'users.info', headers, params)
     if req.status_code == 200:
         response_data = req.json()
         try:
@@ -171,33 +334,83 @@ def is_user_in_workspace(user_id, team_id):
     return False
 
 
-def is_user_workspace_admin(user_id, team_id):
+def _fetch_workspace_admin_ids(team_id):
     """
-    :return: Returns a boolean indicating if the given user is an admin member type in the given team.
+    Fetches every page of the given team's admins.
+    Tier 3 (50+ per minute)
+    :return: A frozenset of admin user ids, or None if Slack returned an error.
     """
-
-    params = {
-        'team_id': team_id,
-        'limit': 100,
-    }
     headers = {
-        'Authorization': f'Bearer {SLACK_TOKEN}',
+        'Authorization': f'Bearer {_slack_token()}',
     }
-    req = requests.get(url=SLACK_ENDPOINT+'admin.teams.admins.list', headers=headers, params=params)
-    if req.status_code == 200:
+    admin_ids = set()
+    cursor = None
+    while True:
+        params = {
+            'team_id': team_id,
+            'limit': 1000,
+        }
+        if cursor:
+            params['cursor'] = cursor
+        req = _coalesced_get('admin.teams.admins.list', SLACK_ENDPOINT+'admin.teams.admins.list', headers, params)
+        if req.status_code != 200:
+            logger.error(f'Slack API error {req.status_code}: {req.text}')
+            return None
         response_data = req.json()
         try:
-            if user_id in response_data['admin_ids']:
-                return True
-            else:
-                return False
-
+            admin_ids.update(response_data['admin_ids'])
         except KeyError:
             logger.error(f'Got unexpected data in API response: {response_data}')
-    else:
-        logger.error(f'Slack API error {req.status_code}: {req.text}')
+            return None
+        cursor = response_data.get('response_metadata', {}).get('next_cursor')
+        if not cursor:
+            return frozenset(admin_ids)
+
+
+def _admin_ids_cache_key(team_id):
+    return get_current_tenant().cache_key('admins', team_id)
+
+
+def get_workspace_admin_ids(team_id):
+    """
+    :return: The ids of the given team's admins, from the shared cache if they were fetched in the last
+    admin_cache_timeout seconds. None if they couldn't be fetched.
+    """
+    cache_key = _admin_ids_cache_key(team_id)
+    admin_ids = cache.get(cache_key)
+    if admin_ids is None:
+        admin_ids = _fetch_workspace_admin_ids(team_id)
+        if admin_ids is not None:
+            cache.set(cache_key, admin_ids, _admin_cache_timeout())
+    return admin_ids
+
+
+def _update_cached_admin_ids(team_id, add=None, discard=None):
+    """
+    Writes a change to a team's admins through to the cached set, if it's cached. Concurrent updates can lose
+    one another; the cost is at most a repeated, idempotent setAdmin until the entry expires.
+    """
+    cache_key = _admin_ids_cache_key(team_id)
+    admin_ids = cache.get(cache_key)
+    if admin_ids is None:
+        return
+    if add:
+        admin_ids = admin_ids | {add}
+    if discard:
+        admin_ids = admin_ids - {discard}
+    cache.set(cache_key, admin_ids, _admin_cache_timeout())
 
-    return False
+
+def _admin_cache_timeout():
+    return settings.SLACK_PROVISIONING.get('admin_cache_timeout', DEFAULT_ADMIN_CACHE_TIMEOUT)
+
+
+def is_user_workspace_admin(user_id, team_id):
+    """
+    :return: Returns a boolean indicating if the given user is an admin member type in the given team.
+    """
+    admin_ids = get_workspace_admin_ids(team_id)
+    return admin_ids is not None and user_id in admin_ids
 
 
 def get_team_info(team_id):
@@ -205,20 +418,19 @@ def get_team_info(team_id):
     This Admin API method fetches information about settings in a workspace.
     Tier 3 (50+ per minute).
     :param team_id: The Slack workspace team_id to get information for.
-    :return: Returns team information from the given team_id if it exists.
+    :return: Returns the TeamSettings of the given team_id if it exists.
     """
     params = {
         'team_id': team_id,
     }
     headers = {
-        'Authorization': f'Bearer {SLACK_TOKEN}',
+        'Authorization': f'Bearer {_slack_token()}',
     }
-    req = requests.get(url=SLACK_ENDPOINT+'admin.teams.settings.info', headers=headers, params=params)
+    req = _coalesced_get('admin.teams.settings.info', SLACK_ENDPOINT+'admin.teams.settings.info', headers, params)
     if req.status_code == 200:
         response_data = req.json()
         try:
-            team = response_data['team']
-            return team
+            return TeamSettings.from_api(response_data['team'])
 
         except KeyError:
             logger.error(f'Got unexpected data in API response: {response_data}')
@@ -232,7 +444,7 @@ def get_default_workspace_channels(team_id):
     """
     :return: Returns a comma separated list of channel ID's of the given team ID. eg: 'C0105PLQG9G’, ‘C010H7XGDCD'
     """
-    return ','.join(get_team_info(team_id=team_id).get('default_channels'))
+    return ','.join(get_team_info(team_id=team_id).default_channels)
 
 
 def set_team_icon(team_id, image_url):
@@ -244,20 +456,82 @@ def set_team_icon(team_id, image_url):
         'image_url': image_url,
     }
     headers = {
-        'Authorization': f'Bearer {SLACK_TOKEN}',
+        'Authorization': f'Bearer {_slack_token()}',
     }
-    req = requests.get(url=SLACK_ENDPOINT+'admin.teams.settings.setIcon', headers=headers, params=params)
+    req = _call('admin.teams.settings.setIcon', 'GET', SLACK_ENDPOINT+'admin.teams.settings.setIcon',
+                headers=headers, params=params)
     response_data = req.json()
     return response_data
 
 
+def set_team_name(team_id, name):
+    """
+    Renames the given workspace.
+    Tier 2 (20+ per minute)
+    """
+    params = {
+        'team_id': team_id,
+        'name': name,
+    }
+    headers = {
+        'Authorization': f'Bearer {_slack_token()}',
+    }
+    req = _call('admin.teams.settings.setName', 'POST', SLACK_ENDPOINT+'admin.teams.settings.setName',
+                headers=headers, data=params)
+    return req.json()
+
+
+def set_team_discoverability(team_id, discoverability):
+    """
+    Sets who can find and request to join the given workspace: open, invite_only, closed, or unlisted.
+    Tier 2 (20+ per minute)
+    """
+    params = {
+        'team_id': team_id,
+        'discoverability': discoverability,
+    }
+    headers = {
+        'Authorization': f'Bearer {_slack_token()}',
+    }
+    req = _call('admin.teams.settings.setDiscoverability', 'POST',
+                SLACK_ENDPOINT+'admin.teams.settings.setDiscoverability', headers=headers, data=params)
+    return req.json()
+
+
+def create_channel(team_id, name, description=None, is_private=False):
+    """
+    Creates a channel in the given workspace.
+    Tier 2 (20+ per minute)
+    :param name: The channel name: lowercase letters, numbers, hyphens and underscores, up to 80 characters.
+    :return: Returns the status of the API call ("ok":True/False) and if success the channel_id of the new channel.
+    """
+    params = {
+        'team_id': team_id,
+        'name': name,
+        'is_private': 'true' if is_private else 'false',
+    }
+    if description:
+        params['description'] = description
+    headers = {
+        'Authorization': f'Bearer {_slack_token()}',
+    }
+    req = _call('admin.conversations.create', 'POST', SLACK_ENDPOINT+'admin.conversations.create',
+                headers=headers, data=params)
+    response_data = req.json()
+
+    logger.info(f'Response data from creating a channel, '
+                f'team id:{team_id}, name:{name}, response data {response_data}')
+
+    return response_data
+
+
 def get_or_create_user_id(email):
     """
     Returns a Slack user account if it exists or will create one using the SCIM API.
     """
     scim_user = get_scim_user_by_email(email)
     if scim_user:
-        return scim_user['id']
+        return scim_user.id
     else:
         user_name = email.split('@')[0].lower()[:21]
         try:
@@ -269,12 +543,13 @@ def get_or_create_user_id(email):
             user_name = user_name[:18]+suffix
             scim_user = create_scim_user(user_name, email)
 
-    return scim_user['id']
+    return scim_user.id
 
 
 def create_scim_user(user_name, email):
     """
     Creates a Slack user account with the given user_name and given email.
+    :return: The new ScimUser
     """
     params = {
         'schemas': [
@@ -289,15 +564,14 @@ def create_scim_user(user_name, email):
         ],
     }
     headers = {
-        'Authorization': f'Bearer {SLACK_TOKEN}',
+        'Authorization': f'Bearer {_slack_token()}',
     }
 
-    req = requests.post(url=SLACK_SCIM_ENDPOINT+'Users', headers=headers, json=params)
+    req = _call('scim.Users.create', 'POST', SLACK_SCIM_ENDPOINT+'Users', headers=headers, json=params)
     response_data = req.json()
     logger.debug(req.text)
     if req.status_code in [200, 201]:
-        scim_user = response_data
-        return scim_user
+        return ScimUser.from_api(response_data)
     elif req.status_code == 409:
         if 'username_taken' in response_data['Errors']['description']:
             raise SlackUsernameTakenError(response_data['Errors']['description'])
@@ -320,9 +594,10 @@ def assign_user_to_workspace(team_id, user_id, channel_ids):
         'channel_ids': channel_ids
     }
     headers = {
-        'Authorization': f'Bearer {SLACK_TOKEN}',
+        'Authorization': f'Bearer {_slack_token()}',
     }
-    req = requests.get(url=SLACK_ENDPOINT+'admin.users.assign', headers=headers, params=params)
+    req = _call('admin.users.assign', 'GET', SLACK_ENDPOINT+'admin.users.assign',
+                headers=headers, params=params)
     if req.status_code == 200:
         return req.json()
     else:
@@ -349,3 +624,8 @@ class SlackUserCreationError(SlackApiError):
 
 class SlackTooManyRequests(SlackApiError):
     pass
+
+
+class SlackApiTimeout(SlackApiError):
+    pass
+
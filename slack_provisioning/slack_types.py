@@ -0,0 +1,86 @@
+"""
+Compact, typed versions of the Slack and SCIM API responses the tool keeps around.
+
+Each is parsed once from the response JSON and holds only the fields the tool uses, in __slots__ (declared by
+hand, so this runs on Pythons older than 3.10). They pickle as a class reference plus a tuple of field values,
+which keeps cache entries small.
+"""
+from dataclasses import dataclass
+
+
+class _Compact:
+    __slots__ = ()
+
+    def __reduce__(self):
+        return self.__class__, tuple(getattr(self, name) for name in self.__slots__)
+
+
+@dataclass
+class ScimUser(_Compact):
+    """
+    A Grid user account, from the SCIM Users API.
+    """
+    __slots__ = ('id', 'user_name', 'email', 'active')
+    id: str
+    user_name: str
+    email: str
+    active: bool
+
+    @classmethod
+    def from_api(cls, resource):
+        emails = resource.get('emails') or []
+        primary = next((email for email in emails if email.get('primary')), emails[0] if emails else {})
+        return cls(
+            id=resource['id'],
+            user_name=resource.get('userName', ''),
+            email=primary.get('value', ''),
+            active=resource.get('active', True),
+        )
+
+
+@dataclass
+class TeamSettings(_Compact):
+    """
+    A workspace's settings, from admin.teams.settings.info.
+    """
+    __slots__ = ('id', 'name', 'domain', 'discoverability', 'default_channels')
+    id: str
+    name: str
+    domain: str
+    discoverability: str
+    default_channels: tuple
+
+    @classmethod
+    def from_api(cls, team):
+        return cls(
+            id=team['id'],
+            name=team.get('name', ''),
+            domain=team.get('domain', ''),
+            discoverability=team.get('discoverability', ''),
+            default_channels=tuple(team.get('default_channels') or ()),
+        )
+
+
+@dataclass
+class WorkspaceUser(_Compact):
+    """
+    A member of a workspace, from admin.users.list.
+    """
+    __slots__ = ('id', 'email', 'is_admin', 'is_owner', 'is_primary_owner', 'is_restricted')
+    id: str
+    email: str
+    is_admin: bool
+    is_owner: bool
+    is_primary_owner: bool
+    is_restricted: bool
+
+    @classmethod
+    def from_api(cls, user):
+        return cls(
+            id=user['id'],
+            email=user.get('email', ''),
+            is_admin=user.get('is_admin', False),
+            is_owner=user.get('is_owner', False),
+            is_primary_owner=user.get('is_primary_owner', False),
+            is_restricted=user.get('is_restricted', False),
+        )
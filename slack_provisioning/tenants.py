@@ -0,0 +1,135 @@
+"""
+Routing of Slack API calls to one of several Enterprise Grids.
+
+Each grid is configured as a tenant in settings.SLACK_PROVISIONING['tenants'], with its own API token, and is
+selected by the LTI consumer key or Canvas account of the launch. Every tenant has its own HTTP connection pool,
+rate limit buckets and caches, so traffic to one grid can't use up another grid's Slack budget or connections.
+Launches that don't match a tenant use the top-level slack_api_token as the "default" tenant.
+"""
+import contextvars
+import logging
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from .ratelimit import RateLimiter
+from .singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TENANT = 'default'
+
+# connections kept open to Slack per tenant; requests beyond this wait for a free connection
+DEFAULT_POOL_SIZE = 10
+
+_current_tenant = contextvars.ContextVar('slack_tenant', default=None)
+_tenants = None
+_tenants_lock = threading.Lock()
+
+
+class SlackTenant:
+    def __init__(self, name, slack_api_token, consumer_keys=(), account_ids=(), pool_size=DEFAULT_POOL_SIZE,
+                 rate_limit_tiers=None, rate_limit_share=1.0):
+        self.name = name
+        self.slack_api_token = slack_api_token
+        self.consumer_keys = frozenset(consumer_keys)
+        self.account_ids = frozenset(str(account_id) for account_id in account_ids)
+        self.pool_size = pool_size
+        self.rate_limiter = RateLimiter(rate_limit_tiers, rate_limit_share, key_prefix=self.cache_key('ratelimit'))
+        self.read_flights = SingleFlight()
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    def __repr__(self):
+        return f'<SlackTenant {self.name}>'
+
+    @property
+    def session(self):
+        """
+        The requests Session for this tenant, created on first use. requests is imported here rather than at
+        module load to keep worker startup cheap.
+        """
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=self.pool_size, pool_block=True)
+                    session.mount('https://', adapter)
+                    self._session = session
+        return self._session
+
+    def cache_key(self, *parts):
+        """
+        :return: A key for the shared Django cache that's private to this tenant.
+        """
+        return ':'.join(['slack', self.name] + [str(part) for part in parts])
+
+
+def _load_tenants():
+    config = settings.SLACK_PROVISIONING
+    tenants = {
+        DEFAULT_TENANT: SlackTenant(DEFAULT_TENANT, config.get('slack_api_token'),
+                                    pool_size=config.get('pool_size', DEFAULT_POOL_SIZE),
+                                    rate_limit_tiers=config.get('rate_limit_tiers'),
+                                    rate_limit_share=config.get('rate_limit_share', 1.0)),
+    }
+    for name, tenant_config in config.get('tenants', {}).items():
+        tenants[name] = SlackTenant(name, **tenant_config)
+    return tenants
+
+
+def all_tenants():
+    global _tenants
+    if _tenants is None:
+        with _tenants_lock:
+            if _tenants is None:
+                _tenants = _load_tenants()
+    return _tenants
+
+
+def get_tenant(name):
+    """
+    :raises KeyError: if no tenant with the given name is configured.
+    """
+    return all_tenants()[name or DEFAULT_TENANT]
+
+
+def get_tenant_for_launch(lti_params):
+    """
+    Picks the tenant for an LTI launch by its OAuth consumer key, then by its Canvas account id.
+    :param lti_params: The launch parameters, eg: request.LTI
+    """
+    consumer_key = lti_params.get('oauth_consumer_key')
+    account_id = lti_params.get('custom_canvas_account_id')
+    tenants = all_tenants()
+    for tenant in tenants.values():
+        if consumer_key in tenant.consumer_keys:
+            return tenant
+    for tenant in tenants.values():
+        if account_id is not None and str(account_id) in tenant.account_ids:
+            return tenant
+    return tenants[DEFAULT_TENANT]
+
+
+def get_current_tenant():
+    """
+    :return: The tenant Slack calls in this context are made for, or the default tenant if none has been set.
+    """
+    return _current_tenant.get() or get_tenant(DEFAULT_TENANT)
+
+
+@contextmanager
+def use_tenant(tenant):
+    """
+    Makes Slack calls inside the block use the given tenant (or tenant name).
+    """
+    if not isinstance(tenant, SlackTenant):
+        tenant = get_tenant(tenant)
+    token = _current_tenant.set(tenant)
+    try:
+        yield tenant
+    finally:
+        _current_tenant.reset(token)
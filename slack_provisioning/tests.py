@@ -1,3 +1,458 @@
-from django.test import TestCase
+import json
+import threading
+import time
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.db import DEFAULT_DB_ALIAS
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase
+
+from . import db_router, views
+from .admission import AdmissionController
+from .middleware import ProfilingMiddleware
+from .db_router import REPLICA_DATABASE, ReplicaRouter, routing_scope
+from .models import SlackWorkspace
+from .ratelimit import BATCH, INTERACTIVE, TokenBucket
+from .roster import MembershipClient, RosterError
+from .singleflight import SingleFlight, SingleFlightTimeout
+from .workspace_cache import WorkspaceCache
+
+
+def _databases(*aliases):
+    return SimpleNamespace(DATABASES={alias: {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}
+                                      for alias in aliases})
+
+
+class ReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        # the router only looks at which aliases are configured, so no replica connection is needed
+        patcher = mock.patch.object(db_router, 'settings', _databases(DEFAULT_DB_ALIAS, REPLICA_DATABASE))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.router = ReplicaRouter()
+
+    def test_reads_go_to_the_replica(self):
+        with routing_scope():
+            self.assertEqual(self.router.db_for_read(SlackWorkspace), REPLICA_DATABASE)
+
+    def test_writes_go_to_the_primary(self):
+        with routing_scope():
+            self.assertEqual(self.router.db_for_write(SlackWorkspace), DEFAULT_DB_ALIAS)
+
+    def test_reads_after_a_write_go_to_the_primary(self):
+        with routing_scope():
+            self.router.db_for_write(SlackWorkspace)
+            self.assertEqual(self.router.db_for_read(SlackWorkspace), DEFAULT_DB_ALIAS)
+
+    def test_a_write_only_pins_its_own_scope(self):
+        with routing_scope():
+            with routing_scope():
+                self.router.db_for_write(SlackWorkspace)
+            self.assertEqual(self.router.db_for_read(SlackWorkspace), REPLICA_DATABASE)
+
+    def test_other_apps_are_not_routed(self):
+        with routing_scope():
+            self.assertIsNone(self.router.db_for_read(User))
+            self.assertIsNone(self.router.db_for_write(User))
+
+    def test_reads_stay_on_the_primary_without_a_replica(self):
+        with mock.patch.object(db_router, 'settings', _databases(DEFAULT_DB_ALIAS)), routing_scope():
+            self.assertIsNone(self.router.db_for_read(SlackWorkspace))
+
+
+class StubResponse:
+    def __init__(self, status_code=200, body=None, headers=None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = headers or {}
+        self.text = json.dumps(body) if body is not None else ''
+
+    def json(self):
+        if self.body is None:
+            raise ValueError('No JSON body')
+        return self.body
+
+
+class StubSession:
+    """
+    Serves canned responses by URL, answering conditional requests that carry the current ETag with a 304.
+    """
+    def __init__(self, pages, etag=None):
+        self.pages = pages
+        self.etag = etag
+        self.requests = []
+
+    def get(self, url, headers=None, params=None, timeout=None):
+        self.requests.append((url, headers))
+        if self.etag and headers.get('If-None-Match') == self.etag:
+            return StubResponse(304)
+        return self.pages[url]
+
+
+def _lis_page(memberships, next_page=None):
+    return {'@id': 'page', 'pageOf': {'membershipSubject': {'membership': memberships}}, 'nextPage': next_page}
+
+
+def _lis_membership(user_id, roles, status='Active'):
+    return {'status': status, 'role': roles,
+            'member': {'user_id': user_id, 'sourcedId': f'{user_id}-sis', 'email': f'{user_id}@example.edu'}}
+
+
+class MembershipClientTests(SimpleTestCase):
+    url = 'https://canvas.example.edu/api/lti/courses/1/membership_service'
+
+    def setUp(self):
+        cache.clear()
+
+    def _univ_ids(self, session, **kwargs):
+        client = MembershipClient(self.url, session=session)
+        return [(member.univ_id, member.is_staff) for member in client.iter_members(**kwargs)]
+
+    def test_reads_lis_containers_across_pages(self):
+        session = StubSession({
+            self.url: StubResponse(body=_lis_page([
+                _lis_membership('teacher', ['Instructor']),
+                _lis_membership('ta', ['urn:lti:role:ims/lis/TeachingAssistant']),
+            ], next_page=f'{self.url}?page=2')),
+            f'{self.url}?page=2': StubResponse(body=_lis_page([
+                _lis_membership('student', ['urn:lti:role:ims/lis/Learner']),
+            ])),
+        })
+        self.assertEqual(self._univ_ids(session),
+                         [('teacher-sis', True), ('ta-sis', True), ('student-sis', False)])
+        self.assertEqual(len(session.requests), 2)
+
+    def test_skips_inactive_members_and_roles_the_tool_does_not_admit(self):
+        session = StubSession({self.url: StubResponse(body=_lis_page([
+            _lis_membership('dropped', ['Learner'], status='Inactive'),
+            _lis_membership('observer', ['urn:lti:role:ims/lis/Mentor']),
+            _lis_membership('admin', ['urn:lti:instrole:ims/lis/Administrator']),
+        ]))})
+        self.assertEqual(self._univ_ids(session), [('admin-sis', True)])
+
+    def test_follows_nrps_link_headers(self):
+        role = 'http://purl.imsglobal.org/vocab/lis/v2/membership'
+        next_url = f'{self.url}?page=2'
+        session = StubSession({
+            self.url: StubResponse(
+                body={'members': [{'user_id': 'a', 'lis_person_sourcedid': 'a-sis', 'roles': [f'{role}#Learner']}]},
+                headers={'Link': f'<{next_url}>; rel="next"'}),
+            next_url: StubResponse(body={'members': [
+                {'user_id': 'b', 'lis_person_sourcedid': 'b-sis', 'roles': [f'{role}/Instructor#TeachingAssistant']},
+            ]}),
+        })
+        self.assertEqual(self._univ_ids(session), [('a-sis', False), ('b-sis', True)])
+
+    def test_serves_the_cached_roster_on_a_304(self):
+        session = StubSession({self.url: StubResponse(body=_lis_page([_lis_membership('student', ['Learner'])]),
+                                                      headers={'ETag': '"v1"'})}, etag='"v1"')
+        self.assertEqual(self._univ_ids(session), [('student-sis', False)])
+        self.assertEqual(self._univ_ids(session), [('student-sis', False)])
+        self.assertEqual(session.requests[1][1]['If-None-Match'], '"v1"')
+
+        # without the cache, the roster is read again in full
+        session.etag = None
+        self.assertEqual(self._univ_ids(session, use_cache=False), [('student-sis', False)])
+        self.assertNotIn('If-None-Match', session.requests[2][1])
+
+    def test_rejects_an_unrecognized_body(self):
+        session = StubSession({self.url: StubResponse(body={'unexpected': []})})
+        with self.assertRaises(RosterError):
+            self._univ_ids(session)
+
+    def test_raises_on_an_error_status(self):
+        session = StubSession({self.url: StubResponse(401, body={'error': 'unauthorized'})})
+        with self.assertRaises(RosterError):
+            self._univ_ids(session)
+
+
+def _start_thread(target, *args):
+    thread = threading.Thread(target=target, args=args, daemon=True)
+    thread.start()
+    return thread
+
+
+class SingleFlightTests(SimpleTestCase):
+    def test_concurrent_calls_share_one_result(self):
+        flights = SingleFlight()
+        release = threading.Event()
+        calls = []
+        results = []
+
+        def fn():
+            calls.append(1)
+            release.wait(5)
+            return 'result'
+
+        threads = [_start_thread(lambda: results.append(flights.do('key', fn, timeout=5))) for _ in range(5)]
+        while flights.stats()['calls'] < 5:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(calls, [1])
+        self.assertEqual(results, ['result'] * 5)
+        self.assertEqual(flights.stats(), {'calls': 5, 'coalesced': 4, 'timeouts': 0, 'errors': 0, 'in_flight': 0})
+
+    def test_the_leaders_exception_is_raised_in_every_caller(self):
+        flights = SingleFlight()
+        release = threading.Event()
+        errors = []
+
+        def fn():
+            release.wait(5)
+            raise ValueError('slack is down')
+
+        def call():
+            try:
+                flights.do('key', fn, timeout=5)
+            except ValueError as e:
+                errors.append(str(e))
+
+        threads = [_start_thread(call) for _ in range(3)]
+        while flights.stats()['calls'] < 3:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(errors, ['slack is down'] * 3)
+        self.assertEqual(flights.stats()['errors'], 1)
+
+    def test_a_follower_gives_up_after_its_timeout(self):
+        flights = SingleFlight()
+        release = threading.Event()
+        leader = _start_thread(flights.do, 'key', lambda: release.wait(5))
+        while flights.stats()['in_flight'] < 1:
+            time.sleep(0.01)
+
+        with self.assertRaises(SingleFlightTimeout):
+            flights.do('key', lambda: None, timeout=0.05)
+        release.set()
+        leader.join(5)
+        self.assertEqual(flights.stats()['timeouts'], 1)
+
+    def test_calls_with_other_keys_and_later_calls_run_again(self):
+        flights = SingleFlight()
+        self.assertEqual(flights.do('a', lambda: 1), 1)
+        self.assertEqual(flights.do('b', lambda: 2), 2)
+        self.assertEqual(flights.do('a', lambda: 3), 3)
+        self.assertEqual(flights.stats()['coalesced'], 0)
+
+
+class AdmissionControllerTests(SimpleTestCase):
+    def test_turns_away_requests_beyond_the_queue(self):
+        controller = AdmissionController(max_concurrent=1, max_queue=1, queue_timeout=5)
+        ticket = controller.acquire()
+        self.assertIsNotNone(ticket)
+
+        queued = []
+        waiter = _start_thread(lambda: queued.append(controller.acquire()))
+        while controller.queued < 1:
+            time.sleep(0.01)
+        # the slot and the queue are both taken
+        self.assertIsNone(controller.acquire())
+
+        controller.release(ticket)
+        waiter.join(5)
+        self.assertIsNotNone(queued[0])
+        controller.release(queued[0])
+
+        stats = controller.stats()
+        self.assertEqual((stats['in_flight'], stats['admitted'], stats['rejected_queue_full']), (0, 2, 1))
+
+    def test_queued_requests_time_out(self):
+        controller = AdmissionController(max_concurrent=1, max_queue=1, queue_timeout=0.05)
+        ticket = controller.acquire()
+        self.assertIsNone(controller.acquire())
+        self.assertEqual(controller.stats()['rejected_timeout'], 1)
+        controller.release(ticket)
+        self.assertIsNotNone(controller.acquire())
+
+    def test_never_admits_more_than_max_concurrent(self):
+        controller = AdmissionController(max_concurrent=2, max_queue=10, queue_timeout=5)
+        lock = threading.Lock()
+        in_flight = []
+        peak = []
+
+        def request():
+            ticket = controller.acquire()
+            with lock:
+                in_flight.append(1)
+                peak.append(len(in_flight))
+            time.sleep(0.02)
+            with lock:
+                in_flight.pop()
+            controller.release(ticket)
+
+        threads = [_start_thread(request) for _ in range(8)]
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(max(peak), 2)
+        self.assertEqual(controller.stats()['admitted'], 8)
+
+
+class TokenBucketTests(SimpleTestCase):
+    def _bucket(self):
+        # one token per second, two of burst, one of them reserved from batch callers
+        return TokenBucket(per_minute=60, burst_seconds=2, batch_reserve=0.5)
+
+    def test_batch_callers_leave_the_reserve(self):
+        bucket = self._bucket()
+        self.assertEqual(bucket.try_acquire(BATCH), 0)
+        self.assertGreater(bucket.try_acquire(BATCH), 0)
+        # the reserved token is still there for an interactive caller
+        self.assertEqual(bucket.try_acquire(INTERACTIVE), 0)
+
+    def test_batch_callers_wait_while_an_interactive_caller_waits(self):
+        bucket = self._bucket()
+        bucket.interactive_waiting = 1
+        self.assertGreater(bucket.try_acquire(BATCH), 0)
+        bucket.interactive_waiting = 0
+        self.assertEqual(bucket.try_acquire(BATCH), 0)
+
+    def test_interactive_callers_wait_for_a_refill(self):
+        bucket = self._bucket()
+        self.assertEqual(bucket.try_acquire(), 0)
+        self.assertEqual(bucket.try_acquire(), 0)
+        self.assertFalse(bucket.acquire(0.05))
+        bucket.tokens = 1
+        self.assertTrue(bucket.acquire(0.05))
+        self.assertEqual(bucket.interactive_waiting, 0)
+
+
+class WorkspaceCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.workspace = SlackWorkspace.objects.create(team_domain='cs-50', team_name='CS 50', team_id='T50',
+                                                       course_sis_id='C50', status='completed', created_by='x')
+
+    def test_serves_completed_rows_from_memory(self):
+        workspace_cache = WorkspaceCache(max_size=10, timeout=60)
+        workspace_cache.get('C50')
+        with self.assertNumQueries(0):
+            self.assertEqual(workspace_cache.get('C50').team_name, 'CS 50')
+        self.assertEqual(workspace_cache.stats()['hits'], 1)
+
+    def test_a_save_in_another_process_invalidates_the_cached_row(self):
+        # each WorkspaceCache stands in for a process; they only share the Django cache
+        other_process = WorkspaceCache(max_size=10, timeout=60)
+        other_process.get('C50')
+        self.workspace.team_name = 'CS 50 renamed'
+        self.workspace.save()
+        self.assertEqual(other_process.get('C50').team_name, 'CS 50 renamed')
+
+    def test_invalidate_after_an_update(self):
+        workspace_cache = WorkspaceCache(max_size=10, timeout=60)
+        other_process = WorkspaceCache(max_size=10, timeout=60)
+        other_process.get('C50')
+        SlackWorkspace.objects.filter(pk=self.workspace.pk).update(team_name='CS 50 updated')
+        self.assertEqual(other_process.get('C50').team_name, 'CS 50')
+        workspace_cache.invalidate('C50')
+        self.assertEqual(other_process.get('C50').team_name, 'CS 50 updated')
+
+    def test_pending_rows_are_not_cached(self):
+        SlackWorkspace.objects.filter(pk=self.workspace.pk).update(status='pending')
+        workspace_cache = WorkspaceCache(max_size=10, timeout=60)
+        workspace_cache.get('C50')
+        with self.assertNumQueries(1):
+            workspace_cache.get('C50')
+
+    def test_callers_get_a_copy(self):
+        workspace_cache = WorkspaceCache(max_size=10, timeout=60)
+        workspace_cache.get('C50').team_name = 'changed by a caller'
+        self.assertEqual(workspace_cache.get('C50').team_name, 'CS 50')
+
+
+class WorkspaceStatusTests(TestCase):
+    def setUp(self):
+        SlackWorkspace.objects.create(team_domain='cs-50', team_name='CS 50', course_sis_id='C50', created_by='x')
+        self.user = User.objects.create(username='student')
+
+    def _get(self, course_sis_id='C50', wait=None, etag=None, lti_course_sis_id='C50', user=None):
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        request = RequestFactory().get(f'/slack_provisioning/status/{course_sis_id}/',
+                                       {'wait': wait} if wait is not None else {}, **headers)
+        request.user = user or self.user
+        request.LTI = {'lis_course_offering_sourcedid': lti_course_sis_id}
+        return views.workspace_status(request, course_sis_id)
+
+    def test_returns_the_status_with_an_etag(self):
+        response = self._get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['status'], 'pending')
+        self.assertTrue(response['ETag'].startswith('"'))
+
+    def test_unchanged_status_is_a_304(self):
+        etag = self._get()['ETag']
+        self.assertEqual(self._get(etag=etag).status_code, 304)
+        self.assertEqual(self._get(etag=f'"other", {etag}').status_code, 304)
+
+    def test_etags_weakened_by_gzip_still_match(self):
+        etag = self._get()['ETag']
+        self.assertEqual(self._get(etag=f'W/{etag}').status_code, 304)
+
+    def test_changed_status_is_a_200(self):
+        etag = self._get()['ETag']
+        SlackWorkspace.objects.filter(course_sis_id='C50').update(status='completed')
+        response = self._get(etag=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertIn('browser_url', json.loads(response.content))
+
+    def test_waits_for_a_change(self):
+        etag = self._get()['ETag']
+        statuses = [{'status': 'pending'}, {'status': 'pending'}, {'status': 'completed'}]
+        with mock.patch.object(views, '_workspace_status', side_effect=statuses), \
+                mock.patch.object(views, '_status_etag', side_effect=[etag, etag, '"changed"']), \
+                mock.patch.object(views.time, 'sleep') as sleep:
+            response = self._get(wait=5, etag=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sleep.call_count, 2)
+
+    def test_answers_at_once_when_every_poll_slot_is_taken(self):
+        etag = self._get()['ETag']
+        slots = threading.BoundedSemaphore(1)
+        slots.acquire()
+        with mock.patch.object(views, '_get_status_poll_slots', return_value=slots), \
+                mock.patch.object(views.time, 'sleep') as sleep:
+            response = self._get(wait=5, etag=etag)
+        self.assertEqual(response.status_code, 304)
+        sleep.assert_not_called()
+
+    def test_only_the_launch_course_can_be_polled(self):
+        with self.assertRaises(PermissionDenied):
+            self._get(lti_course_sis_id='C51')
+
+    def test_needs_a_login(self):
+        response = self._get(user=AnonymousUser())
+        self.assertEqual(response.status_code, 302)
+
+
+def _stub_view(request):
+    return HttpResponse()
+
+
+class ProfilingMiddlewareTests(SimpleTestCase):
+    def _profile_id(self, request_id):
+        middleware = ProfilingMiddleware(lambda request: None)
+        middleware.sample_rate = 1
+        request = RequestFactory().get('/slack_provisioning/metrics/', HTTP_X_REQUEST_ID=request_id)
+        with mock.patch('slack_provisioning.profiling.save_profile') as save_profile:
+            response = middleware.process_view(request, _stub_view, (), {})
+        self.assertEqual(save_profile.call_args[0][1], response['X-Profile-Id'])
+        return response['X-Profile-Id']
+
+    def test_keeps_a_well_formed_request_id(self):
+        self.assertEqual(self._profile_id('abc-123'), 'abc-123')
+
+    def test_replaces_a_request_id_that_is_not_safe_in_a_file_name(self):
+        for request_id in ('../../etc/x', 'a/b', 'x' * 65):
+            profile_id = self._profile_id(request_id)
+            self.assertNotEqual(profile_id, request_id)
+            self.assertRegex(profile_id, r'^[0-9a-f]{32}$')
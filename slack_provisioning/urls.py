@@ -8,7 +8,10 @@ urlpatterns = [
     path('lti_auth_error/', views.lti_oauth_error, name='lti_auth_error'),
     path('tool_config/', views.tool_config, name='tool_config'),
     path('provision_slack_workspace/', views.provision_slack_workspace, name='provision_slack_workspace'),
-    path('join_slack_workspace/', views.join_slack_workspace, name='join_slack_workspace')
+    path('join_slack_workspace/', views.join_slack_workspace, name='join_slack_workspace'),
+    path('export/<str:kind>/', views.export_slack_data, name='export_slack_data'),
+    path('status/<str:course_sis_id>/', views.workspace_status, name='workspace_status'),
+    path('metrics/', views.metrics, name='metrics'),
 ]
 
 if settings.DEBUG:
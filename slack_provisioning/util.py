@@ -4,8 +4,6 @@ import random
 import re
 import string
 
-import boto3
-from botocore.exceptions import ClientError
 from django.conf import settings
 
 # from icommons_common.models import (CourseEnrollee, CourseGuest,
@@ -93,6 +91,21 @@ def get_team_name(course_code, term_name, course_sis_id=None):
     return team_name[:100]
 
 
+def get_section_channel_name(section_sis_id):
+    """
+    :return: A Slack channel name for a course section, eg: "section-20201234567-s01"
+    """
+    name = re.sub(r'[^a-z0-9_\-]', '-', section_sis_id.lower())
+    return f'section-{name}'[:80]
+
+
+def get_team_name_term_marker(term_name):
+    """
+    :return: The part of a team name built by get_team_name that identifies the term, eg: "(Fa 19)"
+    """
+    return f'({_abbreviate_term(term_name, "name")})'
+
+
 def _abbreviate_term(term_name, type='domain'):
     """
     Our terms are named like "2019-2020 Fall", "2019-2020 Spring 1", etc.
@@ -1,33 +1,55 @@
+import hashlib
+import json
 import logging
+import threading
+import time
 import urllib.error
 import urllib.parse
 import urllib.request
 
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
-from django.http import HttpResponse
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
 from django.urls import reverse
+from django.utils.crypto import constant_time_compare
+from django.utils.http import parse_etags, quote_etag
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
-from lti import ToolConfig
 
+import slack_provisioning.audit as audit
+import slack_provisioning.roster as roster
+import slack_provisioning.sections as sections
 import slack_provisioning.util as util
-from slack_provisioning.slack_api import (assign_user_to_workspace,
+from slack_provisioning.admission import admission_controlled, busy_response, get_admission_controller
+from slack_provisioning.export import EXPORT_FORMATS, EXPORTS, export_lines
+from slack_provisioning.workspace_cache import get_active_workspace, get_workspace_cache
+from slack_provisioning.slack_api import (SlackApiError,
+                                          SlackApiTimeout,
+                                          SlackTooManyRequests,
+                                          assign_user_to_workspace,
+                                          coalesced_read_stats,
                                           create_slack_workspace,
                                           get_default_workspace_channels,
                                           get_or_create_user_id,
                                           get_scim_user_by_email,
                                           is_user_in_workspace,
                                           is_user_workspace_admin,
+                                          rate_limit_stats,
                                           set_workspace_admin,
                                           set_team_icon)
-from .models import SlackWorkspace
+from .models import SlackWorkspace, SlackWorkspaceMember
 
 logger = logging.getLogger(__name__)
 
 
 @require_http_methods(['GET'])
 def tool_config(request):
+    # lti pulls in oauthlib and requests, so only import it for the one view that needs it
+    from lti import ToolConfig
+
     url = "https://{}{}".format(request.get_host(), reverse('sp:lti_launch'))
     url = _url(url)
 
@@ -51,6 +73,8 @@ def tool_config(request):
         'canvas_term_name': '$Canvas.term.name',
         'canvas_course_sectionsissourceids': '$Canvas.course.sectionSisSourceIds',
         'canvas_person_email_sis': '$vnd.Canvas.Person.email.sis',
+        'canvas_account_id': '$Canvas.account.id',
+        'context_memberships_url': '$ToolProxyBinding.memberships.url',
     }
 
     lti_tool_config.set_ext_param('canvas.instructure.com', 'custom_fields', custom_fields)
@@ -84,6 +108,7 @@ def _url(url):
 @login_required
 @require_http_methods(['POST'])
 @csrf_exempt
+@admission_controlled
 def lti_launch(request):
     # Check if there is already a Slack workspace for the current course
     # If there is no workspace and the user is a course staff member, allow user to create space via button in template
@@ -107,7 +132,10 @@ def lti_launch(request):
     univ_id = request.LTI.get('lis_person_sourcedid')
     user_email = request.LTI.get('custom_canvas_person_email_sis')
 
-    scim_user = get_scim_user_by_email(user_email)
+    try:
+        scim_user = get_scim_user_by_email(user_email)
+    except SlackApiError as e:
+        return _slack_error_response(request, e)
     user_is_staff = util.is_user_staff(user_roles=user_roles)
 
     logger.debug(request.LTI)
@@ -117,14 +145,15 @@ def lti_launch(request):
     workspace_member = False
 
     try:
-        slack_workspace = SlackWorkspace.objects.get(course_sis_id=course_sis_id)
+        slack_workspace = get_active_workspace(course_sis_id)
         logger.debug(slack_workspace)
+        _update_memberships_url(slack_workspace, request.LTI)
         if slack_workspace and slack_workspace.status == 'completed':
             # the workspace exists and is ready for use
             team_id = slack_workspace.team_id
             if scim_user:
                 # the user already has a Grid user account
-                slack_user_id = scim_user['id']
+                slack_user_id = scim_user.id
                 workspace_member = is_user_in_workspace(user_id=slack_user_id, team_id=team_id)
                 if workspace_member and user_is_staff:
                     workspace_admin = is_user_workspace_admin(user_id=slack_user_id, team_id=team_id)
@@ -134,6 +163,8 @@ def lti_launch(request):
                         set_workspace_admin(team_id=team_id, user_id=slack_user_id)
     except SlackWorkspace.DoesNotExist:
         logger.debug(f'Workspace does not currently exist for course instance {course_sis_id}')
+    except SlackApiError as e:
+        return _slack_error_response(request, e)
     except Exception as e:
         logger.exception(f'Exception in the LTI launch process, {e}')
 
@@ -152,8 +183,36 @@ def lti_launch(request):
     response['Access-Control-Allow-Origin'] = '*'
     return response
 
+
+def _slack_error_response(request, error):
+    """
+    The page shown when a Slack call fails: the busy page if the tool ran out of Slack budget or Slack was too slow,
+    otherwise the error page. Either way the user can try again later.
+    """
+    logger.error(f'Slack API error in {request.path}: {error}')
+    if isinstance(error, (SlackTooManyRequests, SlackApiTimeout)):
+        return busy_response(request)
+    context = {
+        'message': 'Slack returned an error. Please try again later.',
+    }
+    return render(request, 'slack_provisioning/error.html', context, status=502)
+
+
+def _update_memberships_url(slack_workspace, lti_params):
+    """
+    Keeps the workspace's roster source current, so batch jobs can read the roster without a launch.
+    """
+    memberships_url = roster.get_memberships_url(lti_params)
+    consumer_key = lti_params.get('oauth_consumer_key')
+    if memberships_url and (memberships_url, consumer_key) != (slack_workspace.memberships_url,
+                                                               slack_workspace.lti_consumer_key):
+        slack_workspace.memberships_url = memberships_url
+        slack_workspace.lti_consumer_key = consumer_key
+        slack_workspace.save(update_fields=['memberships_url', 'lti_consumer_key'])
+
 @require_http_methods(['POST'])
 @login_required
+@admission_controlled
 def provision_slack_workspace(request):
     """
     Handles the process when a course staff member clicks the "Provision Slack Workspace" button when an space
@@ -171,13 +230,15 @@ def provision_slack_workspace(request):
     user_email = request.LTI.get('custom_canvas_person_email_sis')
     user_is_staff = util.is_user_staff(user_roles=user_roles)
     context = {}
+    errors = False
     if user_is_staff:
-        slack_user_id = get_or_create_user_id(user_email)
+        try:
+            slack_user_id = get_or_create_user_id(user_email)
+        except SlackApiError as e:
+            return _slack_error_response(request, e)
 
         logger.debug(f'LTI: {request.LTI}')
 
-        errors = False
-
         team_domain = util.get_team_domain(course_code, term_name)
         team_name = util.get_team_name(course_code, term_name, course_sis_id)
 
@@ -186,42 +247,98 @@ def provision_slack_workspace(request):
             team_domain=team_domain,
             team_name=team_name,
             created_by=univ_id,
-            course_sis_id=course_sis_id
+            course_sis_id=course_sis_id,
+            term_name=term_name,
+            tenant=request.slack_tenant.name,
+            memberships_url=roster.get_memberships_url(request.LTI),
+            lti_consumer_key=request.LTI.get('oauth_consumer_key'),
         )
 
-        api_call = create_slack_workspace(
-            team_domain=team_domain,
-            team_name=team_name,
-            description=course_title,
-        )
-
-        if api_call['ok'] or api_call['ok'] == 'True':
-            team_id = api_call['team']
-            logger.info(f'Successful workspace creation for course {course_sis_id} - new team ID is {team_id}')
-            slack_workspace.team_id = team_id
-            slack_workspace.save()
-            # Set the team icon
-            set_team_icon(team_id, 'https://tlt-static-prod.s3.amazonaws.com/shields/fas.png')
-            default_channels = get_default_workspace_channels(team_id=team_id)
-            assign_user_to_workspace(user_id=slack_user_id, team_id=team_id, channel_ids=default_channels)
-            set_workspace_admin(team_id=team_id, user_id=slack_user_id)
-            slack_workspace.status = 'completed'
+        try:
+            return _create_workspace(request, slack_workspace, slack_user_id, univ_id, course_title, context)
+        except SlackApiError as e:
+            # a pending row would stop anyone from requesting the workspace again, and a second row would break
+            # the lookups for this course
+            logger.exception(f'Error while provisioning the Slack workspace for course instance {course_sis_id}')
+            audit.record('workspace_creation_failed', team_id=slack_workspace.team_id, slack_user_id=slack_user_id,
+                         detail={'error': str(e)})
+            slack_workspace.status = 'failed'
             slack_workspace.save()
-            context['slack_workspace'] = slack_workspace
+            return _slack_error_response(request, e)
+
+    context['errors'] = errors
+
+    return render(request, 'slack_provisioning/provision_slack_workspace.html', context)
+
+
+def _create_workspace(request, slack_workspace, slack_user_id, univ_id, course_title, context):
+    """
+    Creates the Slack workspace for a new pending workspace row and makes the provisioning user its admin.
+    :raises SlackApiError: if a Slack call fails outright; the caller marks the row failed.
+    """
+    course_sis_id = slack_workspace.course_sis_id
+    errors = False
+    api_call = create_slack_workspace(
+        team_domain=slack_workspace.team_domain,
+        team_name=slack_workspace.team_name,
+        description=course_title,
+    )
+
+    if api_call['ok'] or api_call['ok'] == 'True':
+        team_id = api_call['team']
+        logger.info(f'Successful workspace creation for course {course_sis_id} - new team ID is {team_id}')
+        slack_workspace.team_id = team_id
+        slack_workspace.save()
+        # Set the team icon
+        set_team_icon(team_id, 'https://tlt-static-prod.s3.amazonaws.com/shields/fas.png')
+        audit.record('workspace_created', team_id=team_id, slack_user_id=slack_user_id)
+        default_channels = get_default_workspace_channels(team_id=team_id)
+        # creates the channels of the provisioning user's sections
+        channel_ids = sections.get_channel_ids(slack_workspace, default_channels, request.LTI)
+        response_data = assign_user_to_workspace(user_id=slack_user_id, team_id=team_id, channel_ids=channel_ids)
+        # Slack reports most errors as a 200 with ok: false
+        user_assigned = bool(response_data and response_data.get('ok'))
+        if user_assigned:
+            audit.record('user_assigned', team_id=team_id, slack_user_id=slack_user_id)
         else:
-            logger.error(f'Error while trying to create a Slack workspace for course instance {course_sis_id}: {api_call}')
+            logger.error(f'Could not assign {slack_user_id} to the new workspace {team_id}: {response_data}')
+            audit.record('user_assignment_failed', team_id=team_id, slack_user_id=slack_user_id,
+                         detail=response_data)
             errors = True
-
-            slack_workspace.status = 'failed'
-            slack_workspace.save()
+        if user_assigned:
+            response_data = set_workspace_admin(team_id=team_id, user_id=slack_user_id)
+            # left regular, so a later enrollment sync or launch retries the promotion
+            _record_member(slack_workspace, univ_id, slack_user_id, 'admin' if response_data.get('ok') else 'regular')
+        slack_workspace.status = 'completed'
+        slack_workspace.save()
+        context['slack_workspace'] = slack_workspace
+    else:
+        logger.error(f'Error while trying to create a Slack workspace for course instance {course_sis_id}: {api_call}')
+        errors = True
+        audit.record('workspace_creation_failed', slack_user_id=slack_user_id, detail=api_call)
+
+        slack_workspace.status = 'failed'
+        slack_workspace.save()
 
     context['errors'] = errors
 
     return render(request, 'slack_provisioning/provision_slack_workspace.html', context)
 
 
+def _record_member(slack_workspace, univ_id, slack_user_id, membership_type):
+    """
+    Keeps the member rows that the nightly enrollment sync compares enrollments against up to date.
+    """
+    SlackWorkspaceMember.objects.update_or_create(
+        slack_workspace=slack_workspace,
+        univ_id=univ_id,
+        defaults={'slack_user_id': slack_user_id, 'membership_type': membership_type},
+    )
+
+
 @require_http_methods(['POST'])
 @login_required
+@admission_controlled
 def join_slack_workspace(request):
     context = {}
     errors = False
@@ -238,32 +355,173 @@ def join_slack_workspace(request):
     course_sis_id = request.LTI.get('lis_course_offering_sourcedid')
     univ_id = request.LTI.get('lis_person_sourcedid')
     user_email = request.LTI.get('custom_canvas_person_email_sis')
-    slack_user_id = get_or_create_user_id(user_email)
-    user_is_staff = util.is_user_staff(user_roles=user_roles)
-    slack_workspace = SlackWorkspace.objects.get(course_sis_id=course_sis_id)
-
-    context['slack_workspace'] = slack_workspace
-
-    workspace_member = is_user_in_workspace(user_id=slack_user_id, team_id=slack_workspace.team_id)
-    if not workspace_member:
-        logger.info(f'Current user ({univ_id}) is not a member of the workspace ({slack_workspace.team_id}), '
-                    f'Assigning user now.')
-        default_channels = get_default_workspace_channels(team_id=slack_workspace.team_id)
-        user_assigned = assign_user_to_workspace(user_id=slack_user_id, team_id=slack_workspace.team_id,
-                                                 channel_ids=default_channels)
-        if not user_assigned:
-            errors = True
-        else:
-            if user_is_staff:
-                logger.info(f'User is a staff member for course instance {course_sis_id}, '
-                            f'making them a admin for workspace {slack_workspace.team_id} now.')
-                set_workspace_admin(team_id=slack_workspace.team_id, user_id=slack_user_id)
+    try:
+        slack_user_id = get_or_create_user_id(user_email)
+        user_is_staff = util.is_user_staff(user_roles=user_roles)
+        slack_workspace = get_active_workspace(course_sis_id)
+
+        context['slack_workspace'] = slack_workspace
+
+        workspace_member = is_user_in_workspace(user_id=slack_user_id, team_id=slack_workspace.team_id)
+        if not workspace_member:
+            logger.info(f'Current user ({univ_id}) is not a member of the workspace ({slack_workspace.team_id}), '
+                        f'Assigning user now.')
+            default_channels = get_default_workspace_channels(team_id=slack_workspace.team_id)
+            channel_ids = sections.get_channel_ids(slack_workspace, default_channels, request.LTI)
+            response_data = assign_user_to_workspace(user_id=slack_user_id, team_id=slack_workspace.team_id,
+                                                     channel_ids=channel_ids)
+            # Slack reports most errors as a 200 with ok: false
+            user_assigned = bool(response_data and response_data.get('ok'))
+            if not user_assigned:
+                logger.error(f'Could not assign {slack_user_id} to {slack_workspace.team_id}: {response_data}')
+                audit.record('user_assignment_failed', team_id=slack_workspace.team_id, slack_user_id=slack_user_id,
+                             detail=response_data)
+                errors = True
+            else:
+                audit.record('user_assigned', team_id=slack_workspace.team_id, slack_user_id=slack_user_id)
+                membership_type = 'regular'
+                if user_is_staff:
+                    logger.info(f'User is a staff member for course instance {course_sis_id}, '
+                                f'making them a admin for workspace {slack_workspace.team_id} now.')
+                    response_data = set_workspace_admin(team_id=slack_workspace.team_id, user_id=slack_user_id)
+                    # left regular, so a later enrollment sync or launch retries the promotion
+                    if response_data.get('ok'):
+                        membership_type = 'admin'
+                _record_member(slack_workspace, univ_id, slack_user_id, membership_type)
+    except SlackApiError as e:
+        return _slack_error_response(request, e)
 
     context['errors'] = errors
 
     return render(request, 'slack_provisioning/join_slack_workspace.html', context)
 
 
+@staff_member_required
+@require_http_methods(['GET'])
+def export_slack_data(request, kind):
+    """
+    Streams the workspace or member table as CSV or JSON Lines for the support team.
+    """
+    export_format = request.GET.get('format', 'csv')
+    if kind not in EXPORTS or export_format not in EXPORT_FORMATS:
+        raise Http404
+
+    content_type = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    response = StreamingHttpResponse(export_lines(kind, export_format), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="slack_{kind}.{export_format}"'
+    return response
+
+
+# seconds a status request may wait for a change; clients ask for up to this with ?wait=
+DEFAULT_STATUS_POLL_TIMEOUT = 10
+# status requests allowed to wait at once, per process; the rest are answered right away
+DEFAULT_STATUS_POLL_MAX_CONCURRENT = 2
+# seconds between database checks while a status request waits
+STATUS_POLL_INTERVAL = 1
+
+_status_poll_slots = None
+_status_poll_slots_lock = threading.Lock()
+
+
+def _get_status_poll_slots():
+    global _status_poll_slots
+    if _status_poll_slots is None:
+        with _status_poll_slots_lock:
+            if _status_poll_slots is None:
+                _status_poll_slots = threading.BoundedSemaphore(settings.SLACK_PROVISIONING.get(
+                    'status_poll_max_concurrent', DEFAULT_STATUS_POLL_MAX_CONCURRENT))
+    return _status_poll_slots
+
+
+def _workspace_status(course_sis_id):
+    """
+    :return: The status of the course's workspace and, once it's ready, its links, read from the database only.
+    """
+    slack_workspace = (SlackWorkspace.objects.active()
+                       .filter(course_sis_id=course_sis_id)
+                       .values('status', 'team_name', 'team_domain')
+                       .first())
+    if slack_workspace is None:
+        return {'course_sis_id': course_sis_id, 'status': 'none'}
+
+    status = {'course_sis_id': course_sis_id, 'status': slack_workspace['status']}
+    if slack_workspace['status'] == 'completed':
+        status.update({
+            'team_name': slack_workspace['team_name'],
+            'browser_url': f'https://{slack_workspace["team_domain"]}.slack.com',
+            'app_url': f'https://{slack_workspace["team_domain"]}.slack.com/ssb/redirect',
+        })
+    return status
+
+
+def _status_etag(status):
+    return quote_etag(hashlib.md5(json.dumps(status, sort_keys=True).encode()).hexdigest())
+
+
+@login_required
+@require_http_methods(['GET'])
+def workspace_status(request, course_sis_id):
+    """
+    Reports whether the course's workspace is ready, without calling Slack, for pages that poll while a workspace
+    is being provisioned. Clients send the last ETag in If-None-Match and get a 304 if nothing has changed; with
+    ?wait=<seconds> the request is held until the status changes or the wait is up. Each held request ties up a
+    worker thread, so only status_poll_max_concurrent are held at once per process; others are answered right away
+    and poll again. Only the course of the user's own launch can be polled.
+    """
+    if course_sis_id != request.LTI.get('lis_course_offering_sourcedid'):
+        raise PermissionDenied
+    max_wait = settings.SLACK_PROVISIONING.get('status_poll_timeout', DEFAULT_STATUS_POLL_TIMEOUT)
+    try:
+        wait = min(max(float(request.GET.get('wait', 0)), 0), max_wait)
+    except ValueError:
+        wait = 0
+    # compared weakly, as django.utils.cache does; GZipMiddleware sends the ETag on as W/"..."
+    known_etags = {known_etag.strip('W/') for known_etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))}
+
+    deadline = time.monotonic() + wait
+    status = _workspace_status(course_sis_id)
+    etag = _status_etag(status)
+    if etag in known_etags and wait > 0:
+        slots = _get_status_poll_slots()
+        if slots.acquire(blocking=False):
+            try:
+                while etag in known_etags and time.monotonic() < deadline:
+                    time.sleep(max(0, min(STATUS_POLL_INTERVAL, deadline - time.monotonic())))
+                    status = _workspace_status(course_sis_id)
+                    etag = _status_etag(status)
+            finally:
+                slots.release()
+
+    if etag in known_etags:
+        response = HttpResponse(status=304)
+    else:
+        response = JsonResponse(status)
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@require_http_methods(['GET'])
+def metrics(request):
+    """
+    Admission control, Slack rate limit, coalesced read and workspace cache counters for the worker process that
+    serves the request.
+    Available to admin users, or with the metrics_token setting as a bearer token.
+    """
+    metrics_token = settings.SLACK_PROVISIONING.get('metrics_token')
+    authorized = request.user.is_staff or (
+        metrics_token and constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {metrics_token}'))
+    if not authorized:
+        raise PermissionDenied
+
+    return JsonResponse({
+        'admission': get_admission_controller().stats(),
+        'rate_limits': rate_limit_stats(),
+        'coalesced_reads': coalesced_read_stats(),
+        'workspace_cache': get_workspace_cache().stats(),
+    })
+
+
 def lti_oauth_error(request):
     context = {
         'message': 'LTI authentication failed.'
@@ -0,0 +1,136 @@
+"""
+Per-process cache of completed SlackWorkspace rows, keyed by course_sis_id.
+
+A completed workspace row rarely changes, yet every launch and join looks it up. Completed rows are kept in a
+small LRU for workspace_cache_timeout seconds. Saving or deleting a workspace drops it from this process's LRU
+and bumps a version stamp for the course in the shared Django cache, which other processes check before using
+their copy. Misses are read from the primary database, so a lagging replica can't put an old row in the LRU.
+Rows in any other status (eg: pending) are never cached, so status changes show up on the next request.
+"""
+import copy
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import SlackWorkspace
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_SIZE = 1024
+DEFAULT_TIMEOUT = 60
+
+VERSION_KEY_PREFIX = 'slack:workspace_version'
+# long enough to outlive any cached row
+VERSION_KEY_TIMEOUT = 24 * 60 * 60
+
+
+class WorkspaceCache:
+    def __init__(self, max_size, timeout):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.hits = self.misses = self.invalidations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _version_key(self, course_sis_id):
+        return f'{VERSION_KEY_PREFIX}:{course_sis_id}'
+
+    def _current_version(self, course_sis_id):
+        return cache.get(self._version_key(course_sis_id), 0)
+
+    def get(self, course_sis_id):
+        """
+        :return: A copy of the course's active workspace, from the cache if a completed row is cached and still
+        current.
+        :raises SlackWorkspace.DoesNotExist: if the course has no active workspace.
+        """
+        version = self._current_version(course_sis_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(course_sis_id)
+            if entry is not None:
+                slack_workspace, expires_at, cached_version = entry
+                if expires_at > now and cached_version == version:
+                    self._entries.move_to_end(course_sis_id)
+                    self.hits += 1
+                    # callers may change their copy, eg: sections.ensure_section_channels
+                    return copy.copy(slack_workspace)
+                del self._entries[course_sis_id]
+            self.misses += 1
+
+        # read from the primary; a replica that lags behind the version just read would cache an old row under it.
+        # The version was read first, so a change saved during this query only makes the entry stale.
+        slack_workspace = SlackWorkspace.objects.using(DEFAULT_DB_ALIAS).active().get(course_sis_id=course_sis_id)
+        if slack_workspace.status == 'completed':
+            with self._lock:
+                self._entries[course_sis_id] = (copy.copy(slack_workspace), now + self.timeout, version)
+                self._entries.move_to_end(course_sis_id)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        return slack_workspace
+
+    def invalidate(self, course_sis_id):
+        with self._lock:
+            self._entries.pop(course_sis_id, None)
+            self.invalidations += 1
+        key = self._version_key(course_sis_id)
+        cache.add(key, 0, timeout=VERSION_KEY_TIMEOUT)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # expired between add and incr
+            cache.set(key, 1, timeout=VERSION_KEY_TIMEOUT)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+            }
+
+
+_workspace_cache = None
+_workspace_cache_lock = threading.Lock()
+
+
+def get_workspace_cache():
+    global _workspace_cache
+    if _workspace_cache is None:
+        with _workspace_cache_lock:
+            if _workspace_cache is None:
+                config = settings.SLACK_PROVISIONING
+                _workspace_cache = WorkspaceCache(
+                    max_size=config.get('workspace_cache_size', DEFAULT_MAX_SIZE),
+                    timeout=config.get('workspace_cache_timeout', DEFAULT_TIMEOUT),
+                )
+    return _workspace_cache
+
+
+def get_active_workspace(course_sis_id):
+    """
+    The cached equivalent of SlackWorkspace.objects.active().get(course_sis_id=course_sis_id)
+    """
+    return get_workspace_cache().get(course_sis_id)
+
+
+def invalidate_workspace(course_sis_id):
+    """
+    Call after changing a workspace without save(), eg: with QuerySet.update(), which sends no signals.
+    """
+    if course_sis_id:
+        get_workspace_cache().invalidate(course_sis_id)
+
+
+@receiver(post_save, sender=SlackWorkspace)
+@receiver(post_delete, sender=SlackWorkspace)
+def _workspace_changed(sender, instance, **kwargs):
+    invalidate_workspace(instance.course_sis_id)